@@ -0,0 +1,294 @@
+"""
+Генератор синтетического корпуса для бенчмарков.
+PDF пишутся напрямую (стандартный шрифт Helvetica, изображения в JPEG),
+DOCX собирается как zip-архив WordprocessingML, поэтому кроме Pillow
+для генерации ничего не нужно. Содержимое детерминировано (seed),
+чтобы результаты разных запусков были сравнимы.
+"""
+import io
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+from PIL import Image, ImageDraw
+
+WORDS = ('report analysis revenue quarter total value growth market share period result '
+         'document section table figure summary method data sample average').split()
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 в пунктах
+
+
+def _sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _pdf_string(text):
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def _text_ops(lines, x=50, top=800, leading=14, size=10):
+    ops = [f"BT /F1 {size} Tf {leading} TL {x} {top} Td"]
+    for line in lines:
+        ops.append(f"{_pdf_string(line)} Tj T*")
+    ops.append("ET")
+    return ops
+
+
+def _jpeg(image, quality=85):
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def make_image(width, height, seed=0, text_lines=0):
+    """Синтетическое изображение: градиент, фигуры и, при text_lines > 0, строки текста (как скан)."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    if text_lines:
+        step = max(12, height // (text_lines + 2))
+        for line in range(text_lines):
+            draw.text((width // 12, step * (line + 1)), _sentence(rng, 10), fill='black')
+        return image
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(1, width // 2 + 2)), min(height, y0 + rng.randrange(1, height // 2 + 2))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)((x0, y0, x1, y1), fill=color)
+    return image
+
+
+def write_pdf(path, pages):
+    """
+    Записывает PDF.
+    :param pages: Список страниц; страница - словарь {'ops': [операторы контента],
+                  'images': [(jpeg-байты, ширина, высота, x, y, ширина на странице, высота на странице)]}
+    """
+    objects = []  # содержимое объектов, номер объекта = индекс + 1
+
+    def add(data):
+        objects.append(data)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for page in pages:
+        xobjects = []
+        ops = list(page.get('ops', []))
+        for i, (data, width, height, x, y, w, h) in enumerate(page.get('images', [])):
+            image_id = add(
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB "
+                f"/BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream"
+            )
+            xobjects.append(f"/Im{i} {image_id} 0 R")
+            ops.append(f"q {w} 0 0 {h} {x} {y} cm /Im{i} Do Q")
+        stream = '\n'.join(ops).encode('latin-1')
+        content = add(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+        resources = f"/Font << /F1 {font} 0 R >>"
+        if xobjects:
+            resources += f" /XObject << {' '.join(xobjects)} >>"
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_obj} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << {resources} >> /Contents {content} 0 R >>".encode()
+        ))
+
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_obj} 0 R >>".encode()
+    kids = ' '.join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[pages_obj - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, data in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + data + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    with open(path, 'wb') as f:
+        f.write(out.getvalue())
+    return path
+
+
+def text_pdf(path, pages=20, seed=1):
+    """PDF только с текстовым слоем."""
+    rng = random.Random(seed)
+    return write_pdf(path, [{'ops': _text_ops([_sentence(rng) for _ in range(50)])} for _ in range(pages)])
+
+
+def table_pdf(path, pages=10, rows=20, cols=5, seed=2):
+    """PDF с таблицами, нарисованными линиями (как их находит pdfplumber)."""
+    rng = random.Random(seed)
+    result = []
+    cell_w, cell_h, left, top = 95, 24, 50, 760
+    for _ in range(pages):
+        ops = _text_ops([_sentence(rng, 8)], top=800)
+        ops.append("0.5 w")
+        for r in range(rows + 1):
+            y = top - r * cell_h
+            ops.append(f"{left} {y} m {left + cols * cell_w} {y} l S")
+        for c in range(cols + 1):
+            x = left + c * cell_w
+            ops.append(f"{x} {top} m {x} {top - rows * cell_h} l S")
+        for r in range(rows):
+            for c in range(cols):
+                value = rng.choice(WORDS) if r == 0 else f"{rng.uniform(0, 10000):.2f}"
+                ops.append(f"BT /F1 9 Tf {left + c * cell_w + 4} {top - (r + 1) * cell_h + 8} Td {_pdf_string(value)} Tj ET")
+        result.append({'ops': ops})
+    return write_pdf(path, result)
+
+
+def figure_pdf(path, pages=10, seed=3):
+    """PDF с текстом и изображениями: мелкий логотип и крупная иллюстрация на каждой странице."""
+    rng = random.Random(seed)
+    result = []
+    for page in range(pages):
+        logo = make_image(120, 60, seed=seed * 1000 + page)
+        chart = make_image(800, 500, seed=seed * 2000 + page)
+        result.append({
+            'ops': _text_ops([_sentence(rng) for _ in range(15)]),
+            'images': [
+                (_jpeg(logo), 120, 60, 480, 790, 60, 30),
+                (_jpeg(chart), 800, 500, 50, 150, 480, 300),
+            ],
+        })
+    return write_pdf(path, result)
+
+
+def scanned_pdf(path, pages=5, seed=4):
+    """PDF без текстового слоя: каждая страница - изображение скана с текстом."""
+    result = []
+    for page in range(pages):
+        scan = make_image(1240, 1754, seed=seed * 1000 + page, text_lines=40)
+        result.append({'images': [(_jpeg(scan), 1240, 1754, 0, 0, PAGE_WIDTH, PAGE_HEIGHT)]})
+    return write_pdf(path, result)
+
+
+def _docx_paragraph(text):
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def _docx_table(rows):
+    body = ''.join(
+        '<w:tr>' + ''.join(f'<w:tc>{_docx_paragraph(cell)}</w:tc>' for cell in row) + '</w:tr>'
+        for row in rows
+    )
+    return f'<w:tbl>{body}</w:tbl>'
+
+
+def _docx_image(rel_id):
+    return (
+        '<w:p><w:r><w:drawing><wp:inline><a:graphic><a:graphicData>'
+        f'<pic:pic><pic:blipFill><a:blip r:embed="{rel_id}"/></pic:blipFill></pic:pic>'
+        '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+    )
+
+
+def make_docx(path, paragraphs=60, tables=15, rows=10, cols=4, images=8, seed=5):
+    """DOCX с абзацами, таблицами и встроенными изображениями."""
+    rng = random.Random(seed)
+    body = []
+    rels = []
+    media = {}
+    blocks = ['p'] * paragraphs + ['t'] * tables + ['i'] * images
+    rng.shuffle(blocks)
+    table_n = image_n = 0
+    for block in blocks:
+        if block == 'p':
+            body.append(_docx_paragraph(_sentence(rng, 20)))
+        elif block == 't':
+            table_n += 1
+            header = [rng.choice(WORDS) for _ in range(cols)]
+            data = [[f"{rng.uniform(0, 1000):.1f}" for _ in range(cols)] for _ in range(rows)]
+            body.append(_docx_table([header] + data))
+        else:
+            image_n += 1
+            rel_id = f"rIdImg{image_n}"
+            name = f"image{image_n}.jpeg"
+            media[name] = _jpeg(make_image(640, 400, seed=seed * 1000 + image_n))
+            rels.append(f'<Relationship Id="{rel_id}" '
+                        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+                        f'Target="media/{name}"/>')
+            body.append(_docx_image(rel_id))
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+        'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+        'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+        'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<w:body>{"".join(body)}</w:body></w:document>'
+    )
+    relationships = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'{"".join(rels)}</Relationships>'
+    )
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '</Types>'
+    )
+    root_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/></Relationships>'
+    )
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', content_types)
+        archive.writestr('_rels/.rels', root_rels)
+        archive.writestr('word/document.xml', document)
+        archive.writestr('word/_rels/document.xml.rels', relationships)
+        for name, data in media.items():
+            archive.writestr(f'word/media/{name}', data)
+    return path
+
+
+IMAGE_SIZES = {'small': (320, 240), 'medium': (1280, 960), 'large': (4000, 3000)}
+
+
+def make_images(directory, seed=6):
+    """Изображения разных размеров в JPEG и PNG. :return: {имя: путь}"""
+    paths = {}
+    for label, (width, height) in IMAGE_SIZES.items():
+        image = make_image(width, height, seed=seed)
+        for fmt, ext in (('JPEG', 'jpg'), ('PNG', 'png')):
+            path = os.path.join(directory, f"{label}.{ext}")
+            image.save(path, format=fmt)
+            paths[f"{label}_{ext}"] = path
+    return paths
+
+
+def build_corpus(directory, scale=1.0):
+    """
+    Создаёт весь корпус в directory.
+    :param scale: Множитель числа страниц и блоков (0.2 - быстрый прогон)
+    :return: Словарь {имя: путь}
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    def n(value):
+        return max(1, int(value * scale))
+
+    corpus = {
+        'pdf_text': text_pdf(os.path.join(directory, 'text.pdf'), pages=n(40)),
+        'pdf_tables': table_pdf(os.path.join(directory, 'tables.pdf'), pages=n(10)),
+        'pdf_figures': figure_pdf(os.path.join(directory, 'figures.pdf'), pages=n(10)),
+        'pdf_scanned': scanned_pdf(os.path.join(directory, 'scanned.pdf'), pages=n(5)),
+        'docx': make_docx(os.path.join(directory, 'document.docx'), paragraphs=n(60), tables=n(15), images=n(8)),
+    }
+    corpus.update(make_images(directory))
+    return corpus
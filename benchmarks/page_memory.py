@@ -0,0 +1,129 @@
+"""
+Бенчмарк памяти данных страниц PDF.
+
+Сравнивает прежнее представление страницы (словарь, текст через +=,
+кортеж (шрифт, размер) на каждый символ с последующим set) и PageRecord
+(общая FontTable, отрезки шрифтов в array, текст склеивается один раз).
+PDF и pdfminer не нужны: поток символов страницы генерируется синтетически,
+как его отдаёт разметка pdfminer (символы со шрифтом и служебные пробелы
+и переводы строк). Все страницы документа держатся в памяти, как
+all_pages_data. Каждый режим запускается в отдельном процессе, чтобы
+пиковый RSS одного не влиял на другой.
+
+Запуск:
+    python benchmarks/page_memory.py --pages 2000
+"""
+import argparse
+import json
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doc_extract.pages import FontTable, PageBuilder  # noqa: E402
+
+FONTS = [('ABCDEE+TimesNewRoman', 12.0), ('ABCDEE+TimesNewRoman,Bold', 12.0), ('ABCDEF+Arial', 9.96)]
+WORDS = 'документ анализ страница таблица report value total итог сумма данные'.split()
+
+
+def iter_lines(page_num, lines_per_page, chars_per_line):
+    """Синтетические строки страницы: список (символ, шрифт или None)."""
+    for line in range(lines_per_page):
+        # Заголовки жирным, сноски мелким шрифтом, остальное - основной шрифт
+        font = FONTS[1] if line % 20 == 0 else FONTS[2] if line % 20 == 19 else FONTS[0]
+        chars = []
+        i = page_num + line
+        while len(chars) < chars_per_line:
+            for ch in WORDS[i % len(WORDS)]:
+                chars.append((ch, font))
+            chars.append((' ', None))
+            i += 1
+        chars.append(('\n', None))
+        yield chars
+
+
+def build_dict_pages(pages, lines_per_page, chars_per_line):
+    """Прежнее представление: словарь на страницу."""
+    all_pages_data = {}
+    for page_num in range(pages):
+        page_data = {'text': '', 'images': [], 'tables': [], 'formats': []}
+        for chars in iter_lines(page_num, lines_per_page, chars_per_line):
+            line_text = ''.join(ch for ch, _ in chars)
+            # Как в прежнем text_extraction: новый кортеж на каждый символ
+            line_formats = [(font[0], font[1]) for _, font in chars if font is not None]
+            page_data['text'] += line_text
+            page_data['formats'].extend(list(set(line_formats)))
+        page_data['formats'] = list(set(page_data['formats']))
+        all_pages_data[page_num + 1] = page_data
+    return all_pages_data
+
+
+def build_record_pages(pages, lines_per_page, chars_per_line):
+    """Новое представление: PageRecord с общей таблицей шрифтов."""
+    fonts = FontTable()
+    all_pages_data = {}
+    for page_num in range(pages):
+        builder = PageBuilder(fonts)
+        for chars in iter_lines(page_num, lines_per_page, chars_per_line):
+            # Как в PdfExtraction.text_extraction: символы одного шрифта - одним отрезком
+            run, current = [], None
+            for ch, font in chars:
+                if font is not None and run and font != current:
+                    builder.append(''.join(run), *current)
+                    run = []
+                current = font or current
+                run.append(ch)
+            builder.append(''.join(run), *current)
+        all_pages_data[page_num + 1] = builder.build()
+    return all_pages_data
+
+
+def run_mode(mode, pages, lines_per_page, chars_per_line):
+    """Строит страницы в текущем процессе и возвращает замеры."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    build = build_dict_pages if mode == 'dict' else build_record_pages
+    start = time.perf_counter()
+    data = build(pages, lines_per_page, chars_per_line)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в Linux - в килобайтах
+    return {
+        'mode': mode,
+        'pages': len(data),
+        'seconds': round(elapsed, 2),
+        'peak_rss_mb': round(peak / 1024, 1),
+        'peak_rss_growth_mb_per_1000_pages': round((peak - baseline) / 1024 * 1000 / pages, 1),
+        'pickle_mb': round(len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)) / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=45, help='строк на странице')
+    parser.add_argument('--chars', type=int, default=80, help='символов в строке')
+    parser.add_argument('--mode', choices=['dict', 'record'], help='запустить один режим в этом процессе')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.pages, args.lines, args.chars)))
+        return
+
+    print(f"{'режим':<8}{'страниц':>9}{'секунд':>9}{'пик RSS, МБ':>13}{'МБ на 1000 стр.':>17}{'pickle, МБ':>12}")
+    for mode in ('dict', 'record'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--pages', str(args.pages),
+             '--lines', str(args.lines), '--chars', str(args.chars)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output)
+        print(f"{mode:<8}{result['pages']:>9}{result['seconds']:>9}{result['peak_rss_mb']:>13}"
+              f"{result['peak_rss_growth_mb_per_1000_pages']:>17}{result['pickle_mb']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Бенчмарк холодного старта: время импорта каждой точки входа.
+
+Каждая точка входа импортируется в новом процессе интерпретатора с
+-X importtime. Скрипт записывает медиану времени процесса и импорта по
+нескольким запускам, а также самые тяжёлые прямые зависимости, чтобы
+было видно, что именно загружается при старте.
+
+Запуск:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 5 --out startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Точка входа -> модуль, который она импортирует при запуске
+ENTRY_POINTS = {
+    'web (main.py)': 'main',
+    'batch (ingest.py)': 'ingest',
+    'model.model': 'model.model',
+    'docx': 'doc_extract.docx',
+    'pdf': 'doc_extract.pdf',
+    'images': 'doc_extract.images_descriptions',
+}
+
+
+def parse_importtime(stderr):
+    """
+    Разбирает вывод -X importtime.
+    :return: (суммарное время импорта в секундах, список (модуль, секунды) прямых зависимостей
+             импортируемых модулей)
+    """
+    total = 0.0
+    dependencies = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+        except ValueError:
+            continue
+        # Вложенность обозначается отступом в два пробела на уровень
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        if depth == 0:
+            total += seconds
+        elif depth == 1:
+            dependencies.append((name.strip(), seconds))
+    return total, dependencies
+
+
+def measure(module, repeat):
+    """Импортирует module в новых процессах repeat раз."""
+    wall, imports, heaviest = [], [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        wall.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'ошибка импорта'
+            return {'status': 'error', 'reason': error}
+        total, dependencies = parse_importtime(completed.stderr)
+        imports.append(total)
+        heaviest = sorted(dependencies, key=lambda item: item[1], reverse=True)[:8]
+
+    return {
+        'status': 'ok',
+        'process_seconds': round(statistics.median(wall), 4),
+        'import_seconds': round(statistics.median(imports), 4),
+        'heaviest': [{'module': name, 'seconds': round(seconds, 4)} for name, seconds in heaviest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='запусков на точку входа')
+    parser.add_argument('--out', help='записать результаты в JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for name, module in ENTRY_POINTS.items():
+        result = measure(module, args.repeat)
+        results[name] = {'module': module, **result}
+        if result['status'] == 'ok':
+            heaviest = ', '.join(f"{item['module']} {item['seconds']:.3f}" for item in result['heaviest'][:4])
+            print(f"{name:<20}{result['process_seconds']:>8.3f} с (импорт {result['import_seconds']:.3f} с)  {heaviest}")
+        else:
+            print(f"{name:<20}ошибка: {result['reason']}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'repeat': args.repeat, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {args.out}")
+
+
+if __name__ == '__main__':
+    main()
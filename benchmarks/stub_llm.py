@@ -0,0 +1,120 @@
+"""
+Локальная замена g4f для бенчмарков.
+install() подменяет модули g4f и g4f.client до импорта кода проекта,
+поэтому все запросы к модели обслуживает StubClient: ответ приходит
+после заданной задержки, сеть не используется.
+"""
+import sys
+import time
+import types
+import threading
+
+ANSWER = ("Документ содержит текст, таблицы и изображения. Основные разделы: введение, "
+          "методика, результаты и выводы. Таблицы содержат числовые данные по периодам. ")
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content, delta=False):
+        if delta:
+            self.delta = _Message(content)
+        else:
+            self.message = _Message(content)
+
+
+class _Response:
+    def __init__(self, content, delta=False):
+        self.choices = [_Choice(content, delta)]
+
+
+class StubStats:
+    """Счётчики запросов к заглушке: число запросов и суммарный размер промптов в символах."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_chars = 0
+        self.image_parts = 0
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.prompt_chars = 0
+            self.image_parts = 0
+
+    def record(self, messages):
+        chars = 0
+        images = 0
+        for message in messages:
+            content = message.get('content')
+            if isinstance(content, str):
+                chars += len(content)
+                continue
+            for part in content or []:
+                if part.get('type') == 'text':
+                    chars += len(part.get('text', ''))
+                elif part.get('type') == 'image_url':
+                    images += 1
+                    chars += len(part['image_url'].get('url', ''))
+        with self._lock:
+            self.requests += 1
+            self.prompt_chars += chars
+            self.image_parts += images
+
+    def snapshot(self):
+        with self._lock:
+            return {'requests': self.requests, 'prompt_chars': self.prompt_chars, 'image_parts': self.image_parts}
+
+
+stats = StubStats()
+
+
+class _Completions:
+    def __init__(self, settings):
+        self.settings = settings
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        stats.record(messages or [])
+        time.sleep(self.settings['latency'])
+        answer = self.settings['answer']
+        if not stream:
+            return _Response(answer)
+        return self._stream(answer)
+
+    def _stream(self, answer):
+        words = answer.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(self.settings['token_delay'])
+            yield _Response(word if i == len(words) - 1 else word + ' ', delta=True)
+
+
+class StubClient:
+    """Клиент с интерфейсом g4f.client.Client: client.chat.completions.create(...)."""
+
+    settings = {'latency': 0.05, 'token_delay': 0.0, 'answer': ANSWER}
+
+    def __init__(self, *args, **kwargs):
+        self.chat = types.SimpleNamespace(completions=_Completions(self.settings))
+
+
+def install(latency=0.05, token_delay=0.0, answer=ANSWER):
+    """
+    Подменяет g4f заглушкой. Вызывать до импорта модулей проекта.
+    :param latency: Задержка до ответа (до первого токена при stream=True), секунд
+    :param token_delay: Задержка между токенами потокового ответа, секунд
+    :param answer: Текст ответа
+    """
+    StubClient.settings.update(latency=latency, token_delay=token_delay, answer=answer)
+
+    g4f = types.ModuleType('g4f')
+    client = types.ModuleType('g4f.client')
+    client.Client = StubClient
+    g4f.client = client
+    g4f.Provider = types.SimpleNamespace()
+    sys.modules['g4f'] = g4f
+    sys.modules['g4f.client'] = client
+    return stats
@@ -0,0 +1,234 @@
+"""
+Офлайн-бенчмарки горячих путей проекта.
+
+Генерирует синтетический корпус (PDF с текстом, таблицами, изображениями
+и сканами, DOCX с таблицами и изображениями, изображения разных размеров),
+подменяет g4f локальной заглушкой с настраиваемой задержкой и замеряет:
+extract_pages_pdf, DocxExtracting.make_description,
+ImageExtractions.encode_image и чат от загрузки файла до ответов
+(handle_upload и chat_interface из main.py).
+
+Кэши извлечения и изображений отключаются, иначе повторы мерили бы кэш.
+Результат - JSON с медианой и всеми замерами каждого случая. С --compare
+новый прогон сравнивается с сохранённым, при замедлении больше порога
+процесс завершается с кодом 1.
+
+Запуск:
+    python benchmarks/suite.py --out results.json
+    python benchmarks/suite.py --scale 0.2 --repeat 1 --only pdf
+    python benchmarks/suite.py --out new.json --compare results.json --threshold 0.2
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import stub_llm  # noqa: E402
+from benchmarks.corpus import build_corpus  # noqa: E402
+
+
+class Skip(Exception):
+    """Случай нельзя выполнить в этом окружении (нет зависимости или утилиты)."""
+
+
+def _import(name):
+    try:
+        return __import__(name, fromlist=['*'])
+    except ImportError as e:
+        raise Skip(f"не удалось импортировать {name}: {e}")
+
+
+def bench_pdf(path):
+    def run():
+        pdf = _import('doc_extract.pdf')
+        if not shutil.which('pdftoppm'):
+            raise Skip("нет pdftoppm (poppler)")
+        pages = pdf.extract_pages_pdf(path)
+        return {'pages': len(pages), 'chars': sum(len(page['text']) for page in pages.values())}
+    return run
+
+
+def bench_docx(path):
+    def run():
+        docx = _import('doc_extract.docx')
+        description = docx.DocxExtracting(path, image_dir=tempfile.gettempdir()).make_description()
+        return {'chars': len(description)}
+    return run
+
+
+def bench_encode(path, detail='high'):
+    def run():
+        images = _import('doc_extract.images_descriptions')
+        data_url = images.ImageExtractions(path).encode_image(detail=detail)
+        return {'encoded_chars': len(data_url or '')}
+    return run
+
+
+def bench_chat(path, turns):
+    def run():
+        main = _import('main')
+        status = None
+        history = memory = session = upload = None
+        for status, history, _, memory, session, upload in main.handle_upload(path, None):
+            pass
+        # Первый анализ - отдельный шаг после извлечения (в приложении - .then в группе "llm")
+        for status, history, _, memory, session, _ in main.handle_analysis(upload, status, history, memory, session):
+            pass
+        for i in range(turns):
+            for history, _, _, memory, session in main.chat_interface(
+                    f"What does table {i + 1} say about revenue?", history, memory, session):
+                pass
+        main.new_session(session)
+        return {'turns': len(history)}
+    return run
+
+
+def build_cases(corpus, chat_turns):
+    """Список (имя, группа, функция) всех случаев."""
+    cases = [
+        ('extract_pages_pdf.text', 'pdf', bench_pdf(corpus['pdf_text'])),
+        ('extract_pages_pdf.tables', 'pdf', bench_pdf(corpus['pdf_tables'])),
+        ('extract_pages_pdf.figures', 'pdf', bench_pdf(corpus['pdf_figures'])),
+        ('extract_pages_pdf.scanned', 'pdf', bench_pdf(corpus['pdf_scanned'])),
+        ('docx.make_description', 'docx', bench_docx(corpus['docx'])),
+    ]
+    for key in sorted(corpus):
+        if key.split('_')[0] in ('small', 'medium', 'large'):
+            cases.append((f'encode_image.{key}', 'image', bench_encode(corpus[key])))
+            # Описания изображений запрашиваются с detail='low'
+            cases.append((f'encode_image.low.{key}', 'image', bench_encode(corpus[key], 'low')))
+    cases.append(('chat.end_to_end', 'chat', bench_chat(corpus['pdf_text'], chat_turns)))
+    return cases
+
+
+def run_case(name, func, repeat, stats):
+    """Выполняет случай repeat раз и возвращает запись результата."""
+    seconds = []
+    metrics = {}
+    llm = None
+    try:
+        for _ in range(repeat):
+            stats.reset()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                metrics = func() or {}
+                seconds.append(time.perf_counter() - start)
+            llm = stats.snapshot()
+    except Skip as e:
+        return {'name': name, 'status': 'skipped', 'reason': str(e)}
+    except Exception as e:
+        return {'name': name, 'status': 'error', 'reason': f"{type(e).__name__}: {e}"}
+
+    return {
+        'name': name,
+        'status': 'ok',
+        'median': statistics.median(seconds),
+        'min': min(seconds),
+        'seconds': seconds,
+        'metrics': metrics,
+        'llm': llm,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Сравнивает медианы с сохранённым прогоном.
+    :return: Список регрессий (имя, было, стало)
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {r['name']: r for r in json.load(f)['results'] if r.get('status') == 'ok'}
+    regressions = []
+    for result in results:
+        old = baseline.get(result['name'])
+        if result['status'] != 'ok' or old is None:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else 1.0
+        mark = 'РЕГРЕССИЯ' if ratio > 1 + threshold else ''
+        print(f"{result['name']:<36}{old['median']:>10.3f}{result['median']:>10.3f}{ratio:>8.2f}x  {mark}")
+        if mark:
+            regressions.append((result['name'], old['median'], result['median']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='benchmark_results.json', help='куда записать JSON с результатами')
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель размера корпуса')
+    parser.add_argument('--repeat', type=int, default=3, help='повторов каждого случая')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа заглушки LLM, секунд')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='задержка между токенами потока, секунд')
+    parser.add_argument('--chat-turns', type=int, default=3, help='вопросов в чате после загрузки')
+    parser.add_argument('--only', action='append', choices=['pdf', 'docx', 'image', 'chat'],
+                        help='запустить только указанные группы')
+    parser.add_argument('--corpus-dir', help='директория корпуса (по умолчанию временная)')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для поиска регрессий')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление медианы (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    # До импорта модулей проекта: заглушка вместо g4f, без кэшей и отладочных файлов
+    stats = stub_llm.install(latency=args.latency, token_delay=args.token_delay)
+    os.environ['EXTRACTION_CACHE'] = '0'
+    os.environ['IMAGE_CACHE'] = '0'
+    os.environ.pop('DEBUG_IMAGE_DIR', None)
+
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix='docanalyzer_bench_')
+    try:
+        corpus = build_corpus(corpus_dir, scale=args.scale)
+        results = []
+        for name, group, func in build_cases(corpus, args.chat_turns):
+            if args.only and group not in args.only:
+                continue
+            result = run_case(name, func, args.repeat, stats)
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"{name:<36}{result['median']:>10.3f} с  {result['metrics']}  llm={result['llm']}")
+            else:
+                print(f"{name:<36}{result['status']}: {result['reason']}")
+    finally:
+        if not args.corpus_dir:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'tools': {tool: bool(shutil.which(tool)) for tool in ('pdftoppm', 'tesseract')},
+            'settings': {key: value for key, value in vars(args).items() if key not in ('out', 'compare')},
+        },
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"Найдено регрессий: {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
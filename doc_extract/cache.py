@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from doc_extract.metrics import metrics
+
+# Версия формата результатов извлечения. Увеличивайте при изменении
+# вывода экстракторов, чтобы старые записи кэша перестали совпадать.
+EXTRACTOR_VERSION = 7
+
+
+class ExtractionCache:
+    """
+    Дисковый кэш результатов извлечения документов.
+    Ключ - хэш содержимого файла, версии экстрактора и настроек, поэтому
+    повторная загрузка того же файла (под любым именем) отдаёт сохранённый
+    результат. Размер ограничен, вытесняются давно не использованные записи.
+    Тот же класс с другими name и директорией хранит пересказы частей
+    документа (model.analysis), не смешиваясь с результатами извлечения.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024, name='extraction'):
+        """
+        :param cache_dir: Директория кэша (по умолчанию EXTRACTION_CACHE_DIR или .cache/extraction)
+        :param max_bytes: Максимальный суммарный размер записей в байтах
+        :param name: Имя кэша в метриках cache_requests_total{cache}
+        """
+        self.cache_dir = cache_dir or os.environ.get('EXTRACTION_CACHE_DIR', os.path.join('.cache', 'extraction'))
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_digest(file_path, chunk_size=1024 * 1024):
+        """Считает sha256 содержимого файла, читая его блоками."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def make_key(self, file_path, settings=None):
+        """Формирует ключ из хэша файла, версии экстрактора и настроек."""
+        payload = json.dumps(
+            {'file': self.file_digest(file_path), 'version': EXTRACTOR_VERSION, 'settings': settings or {}},
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Возвращает сохранённый результат или None.
+        При попадании обновляет время доступа записи для LRU.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, pickle.PickleError, EOFError):
+            with self._lock:
+                self.misses += 1
+            metrics.inc('cache_requests_total', cache=self.name, result='miss')
+            return None
+
+        with self._lock:
+            self.hits += 1
+        metrics.inc('cache_requests_total', cache=self.name, result='hit')
+        return value
+
+    def put(self, key, value):
+        """Атомарно сохраняет результат и при необходимости вытесняет старые записи."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._entry_path(key))
+        except Exception as e:
+            print(f"Ошибка при записи в кэш: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def get_or_compute(self, file_path, compute, settings=None, should_store=None):
+        """
+        Возвращает результат из кэша или вычисляет и сохраняет его.
+        :param compute: Функция без аргументов, выполняющая извлечение
+        :param should_store: Функция-фильтр результата (например, не кэшировать ошибки)
+        """
+        try:
+            key = self.make_key(file_path, settings)
+        except OSError as e:
+            print(f"Кэш недоступен для {file_path}: {e}")
+            return compute()
+
+        value = self.get(key)
+        if value is not None:
+            print(f"Результат извлечения взят из кэша ({key[:12]})")
+            return value
+
+        value = compute()
+        if should_store is None or should_store(value):
+            self.put(key, value)
+        return value
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока размер кэша превышает max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.pkl'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        """Возвращает счётчики попаданий и промахов."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def perceptual_hash(image, hash_size=8):
+    """
+    Разностный перцептивный хэш (dHash) изображения.
+    Изображение уменьшается до (hash_size + 1) x hash_size в оттенках серого,
+    каждый бит - сравнение соседних пикселей строки. Почти одинаковые
+    изображения дают хэши с малым расстоянием Хэмминга.
+    :return: Хэш в виде шестнадцатеричной строки (hash_size * hash_size бит)
+    """
+    from PIL import Image
+
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = gray.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def pixel_digest(image):
+    """
+    Точный хэш изображения: sha256 режима, размера и пикселей.
+    Совпадает только у изображений с одинаковыми пикселями - для страниц и
+    изображений с текстом, где похожие изображения могут отличаться содержанием.
+    :return: Хэш в виде шестнадцатеричной строки
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode('ascii'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ImageResultCache:
+    """
+    Постоянный кэш результатов по изображениям (описания, OCR) в SQLite.
+    Ключ - перцептивный хэш; при отсутствии точного совпадения берётся
+    ближайший хэш того же вида в пределах max_distance бит, поэтому
+    повторяющиеся логотипы, печати и подписи обрабатываются один раз.
+    При превышении max_entries вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, db_path=None, max_entries=20000, max_distance=4):
+        """
+        :param db_path: Путь к базе (по умолчанию IMAGE_CACHE_PATH или .cache/images.sqlite3)
+        :param max_entries: Максимальное число записей
+        :param max_distance: Допустимое расстояние Хэмминга для почти одинаковых изображений
+        """
+        self.db_path = db_path or os.environ.get('IMAGE_CACHE_PATH', os.path.join('.cache', 'images.sqlite3'))
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "kind TEXT NOT NULL, hash TEXT NOT NULL, value TEXT NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (kind, hash))"
+        )
+        self._conn.commit()
+
+        # Индекс хэшей в памяти для поиска ближайшего: {kind: {hash: int}}
+        self._index = {}
+        for kind, image_hash in self._conn.execute("SELECT kind, hash FROM results"):
+            self._index.setdefault(kind, {})[image_hash] = int(image_hash, 16)
+
+    def _nearest(self, kind, image_hash, max_distance):
+        """Находит сохранённый хэш того же вида с наименьшим расстоянием Хэмминга."""
+        hashes = self._index.get(kind, {})
+        if image_hash in hashes:
+            return image_hash
+        if max_distance <= 0:
+            return None
+
+        target = int(image_hash, 16)
+        best, best_distance = None, max_distance + 1
+        for stored_hash, bits in hashes.items():
+            if len(stored_hash) != len(image_hash):
+                continue
+            distance = (bits ^ target).bit_count()
+            if distance < best_distance:
+                best, best_distance = stored_hash, distance
+        return best
+
+    def lookup(self, kind, image_hash, max_distance=None):
+        """
+        Ищет результат для изображения.
+        :param kind: Вид результата, например "ocr" или "caption:<модель>:<detail>:exact"
+        :param max_distance: Переопределяет допустимое расстояние для этого вида
+        :return: Сохранённая строка или None
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+
+        with self._lock:
+            stored_hash = self._nearest(kind, image_hash, max_distance)
+            row = None
+            if stored_hash is not None:
+                row = self._conn.execute(
+                    "SELECT value FROM results WHERE kind = ? AND hash = ?", (kind, stored_hash)
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc('cache_requests_total', cache=kind.split(':')[0], result='miss')
+                return None
+
+            self._conn.execute(
+                "UPDATE results SET last_used = ? WHERE kind = ? AND hash = ?", (time.time(), kind, stored_hash)
+            )
+            self._conn.commit()
+            self.hits += 1
+            metrics.inc('cache_requests_total', cache=kind.split(':')[0], result='hit')
+            return row[0]
+
+    def put(self, kind, image_hash, value):
+        """Сохраняет результат и вытесняет лишние записи."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (kind, hash, value, last_used) VALUES (?, ?, ?, ?)",
+                (kind, image_hash, value, time.time()),
+            )
+            self._index.setdefault(kind, {})[image_hash] = int(image_hash, 16)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Удаляет давно не использованные записи сверх max_entries (вызывается под блокировкой)."""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+
+        evicted = self._conn.execute(
+            "SELECT kind, hash FROM results ORDER BY last_used LIMIT ?", (excess,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM results WHERE kind = ? AND hash = ?", evicted)
+        for kind, image_hash in evicted:
+            self._index.get(kind, {}).pop(image_hash, None)
+
+    def stats(self):
+        """Возвращает счётчики попаданий и промахов."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_image_cache = None
+_image_cache_pid = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """
+    Возвращает общий кэш результатов по изображениям.
+    IMAGE_CACHE=0 отключает кэш, IMAGE_CACHE_MAX_ENTRIES и
+    IMAGE_CACHE_MAX_DISTANCE задают вытеснение и допуск совпадения.
+    :return: ImageResultCache или None, если кэш отключён или недоступен
+    """
+    global _image_cache, _image_cache_pid
+    if os.environ.get('IMAGE_CACHE', '1') == '0':
+        return None
+    # Соединение SQLite нельзя наследовать при fork - в процессах пула открываем своё
+    if _image_cache is None or _image_cache_pid != os.getpid():
+        with _image_cache_lock:
+            if _image_cache is None or _image_cache_pid != os.getpid():
+                try:
+                    _image_cache = ImageResultCache(
+                        max_entries=int(os.environ.get('IMAGE_CACHE_MAX_ENTRIES', 20000)),
+                        max_distance=int(os.environ.get('IMAGE_CACHE_MAX_DISTANCE', 4)),
+                    )
+                    _image_cache_pid = os.getpid()
+                except (sqlite3.Error, OSError) as e:
+                    print(f"Кэш изображений недоступен: {e}")
+                    return None
+    return _image_cache
@@ -1,97 +1,309 @@
 import os
-from docx import Document
-import docx2txt
-from doc_extract.images_descriptions import ImageExtractions
+import re
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from doc_extract.metrics import metrics
+from model.prompt import rows_markdown
+
+# Растровые форматы, которые можно передать в OCR и модель
+VALID_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+# Пространства имён WordprocessingML
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+A_BLIP = '{http://schemas.openxmlformats.org/drawingml/2006/main}blip'
+V_IMAGEDATA = '{urn:schemas-microsoft-com:vml}imagedata'
+
+
+def _natural_key(name):
+    """Ключ натуральной сортировки: image2 идёт раньше image10."""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def _read_image_relationships(archive):
+    """Возвращает {rId: путь в архиве} для изображений из word/_rels/document.xml.rels."""
+    try:
+        data = archive.read('word/_rels/document.xml.rels')
+    except KeyError:
+        return {}
+
+    targets = {}
+    for rel in ET.fromstring(data).iter(f'{REL}Relationship'):
+        target = rel.get('Target', '')
+        if rel.get('TargetMode') == 'External' or not target.lower().endswith(VALID_IMAGE_EXTENSIONS):
+            continue
+        path = target.lstrip('/') if target.startswith('/') else posixpath.join('word', target)
+        targets[rel.get('Id')] = posixpath.normpath(path)
+    return targets
+
+
+def _grid_count(elem, default):
+    """Число колонок из w:val (gridSpan, gridBefore); без значения или некорректное - default."""
+    try:
+        return max(0, int(elem.get(f'{W}val', default)))
+    except ValueError:
+        return default
+
+
+def _read_member(archive, name):
+    """Читает файл из архива; отсутствующий файл даёт None."""
+    try:
+        return archive.read(name)
+    except KeyError:
+        print(f"В документе нет файла {name}")
+        return None
+
 
 class DocxExtracting:
-    def __init__(self, path_to_docx):
+    def __init__(self, path_to_docx, image_dir="./images", ocr_images=False):
         """
         Инициализирует класс с путём к файлу .docx.
         :param path_to_docx: Путь к файлу .docx
+        :param image_dir: Директория для извлечённых изображений (своя для каждой сессии)
+        :param ocr_images: Распознавать текст на изображениях (через общий OcrEngine)
         """
         self.path = path_to_docx  # Сохраняем путь к файлу .docx
+        self.image_dir = image_dir
+        self.ocr_images = ocr_images
+        # Ошибки описания и OCR изображений последнего make_description
+        self.errors = []
+
+    def iter_blocks(self, include_unreferenced_images=True):
+        """
+        Потоково разбирает word/document.xml за один проход по архиву.
+        Отдаёт блоки в порядке документа:
+        ('paragraph', текст), ('table', строки), ('image', имя файла, байты).
+        Объединённые ячейки выводятся один раз: у ячейки с gridSpan за текстом
+        идут gridSpan - 1 пустых ячеек, продолжение вертикального объединения -
+        пустая строка, пропущенные в начале строки колонки (gridBefore) - пустые
+        ячейки. Так ячейки каждой строки остаются под своими заголовками.
+        Обработанные элементы удаляются из дерева, поэтому память не растёт
+        с размером документа.
+        :param include_unreferenced_images: Отдать в конце изображения из word/media,
+                                            на которые нет ссылок в тексте (колонтитулы и т.п.)
+        """
+        with zipfile.ZipFile(self.path) as archive:
+            relationships = _read_image_relationships(archive)
+            emitted_images = set()
+            pending_images = []
+
+            body = None
+            paragraphs = []     # стек текста параграфов (вложенные - надписи внутри параграфа)
+            tables = []         # стек таблиц: список строк
+            rows = []           # стек текущих строк
+            cells = []          # стек текущих ячеек: {'parts', 'vmerge', 'span'}
+
+            with archive.open('word/document.xml') as xml_file:
+                for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+                    tag = elem.tag
+                    if event == 'start':
+                        if tag == f'{W}body':
+                            body = elem
+                        elif tag == f'{W}p':
+                            paragraphs.append([])
+                        elif tag == f'{W}tbl':
+                            tables.append([])
+                        elif tag == f'{W}tr':
+                            rows.append([])
+                        elif tag == f'{W}tc':
+                            cells.append({'parts': [], 'vmerge': None, 'span': 1})
+                        continue
+
+                    if tag == f'{W}t':
+                        if paragraphs and elem.text:
+                            paragraphs[-1].append(elem.text)
+                    elif tag == f'{W}tab':
+                        if paragraphs:
+                            paragraphs[-1].append('\t')
+                    elif tag in (f'{W}br', f'{W}cr'):
+                        if paragraphs:
+                            paragraphs[-1].append('\n')
+                    elif tag == f'{W}vMerge':
+                        if cells:
+                            cells[-1]['vmerge'] = elem.get(f'{W}val', 'continue')
+                    elif tag == f'{W}gridSpan':
+                        if cells:
+                            cells[-1]['span'] = max(1, _grid_count(elem, 1))
+                    elif tag == f'{W}gridBefore':
+                        # Свойства строки идут до её ячеек: открытых ячеек меньше, чем строк
+                        if rows and len(cells) < len(rows):
+                            rows[-1].extend([''] * _grid_count(elem, 0))
+                    elif tag in (A_BLIP, V_IMAGEDATA):
+                        target = relationships.get(elem.get(f'{R}embed') or elem.get(f'{R}id'))
+                        if target and target not in emitted_images:
+                            emitted_images.add(target)
+                            pending_images.append(target)
+                    elif tag == f'{W}p':
+                        text = ''.join(paragraphs.pop())
+                        if paragraphs:
+                            # Надпись внутри параграфа - дописываем к нему
+                            paragraphs[-1].append(text)
+                        elif cells:
+                            cells[-1]['parts'].append(text)
+                        elif not tables:
+                            yield 'paragraph', text
+                    elif tag == f'{W}tc':
+                        cell = cells.pop()
+                        text = '' if cell['vmerge'] == 'continue' else '\n'.join(cell['parts']).strip()
+                        if rows:
+                            rows[-1].append(text)
+                            rows[-1].extend([''] * (cell['span'] - 1))
+                    elif tag == f'{W}tr':
+                        row = rows.pop()
+                        if tables:
+                            tables[-1].append(row)
+                        elem.clear()
+                    elif tag == f'{W}tbl':
+                        table = tables.pop()
+                        if cells:
+                            # Вложенная таблица становится текстом ячейки
+                            cells[-1]['parts'].append('\n'.join(' | '.join(row) for row in table))
+                        elif not tables:
+                            yield 'table', table
+
+                    # Блок верхнего уровня обработан - освобождаем дерево и отдаём его изображения
+                    if not paragraphs and not tables and tag in (f'{W}p', f'{W}tbl', f'{W}sdt'):
+                        yield from self._image_blocks(archive, pending_images)
+                        pending_images = []
+                        if body is not None:
+                            body.clear()
+
+            yield from self._image_blocks(archive, pending_images)
+
+            if include_unreferenced_images:
+                media = sorted(
+                    (name for name in archive.namelist()
+                     if name.startswith('word/media/') and name.lower().endswith(VALID_IMAGE_EXTENSIONS)
+                     and name not in emitted_images),
+                    key=_natural_key,
+                )
+                yield from self._image_blocks(archive, media)
+
+    @staticmethod
+    def _image_blocks(archive, names):
+        """Отдаёт блоки ('image', имя файла, байты) для изображений из архива."""
+        for name in names:
+            data = _read_member(archive, name)
+            if data is not None:
+                yield 'image', posixpath.basename(name), data
 
     def text_extract(self):
         """
-        Извлекает текст из параграфов и таблиц документа.
+        Извлекает текст из параграфов и таблиц документа (потоково, см. iter_blocks).
         :return: Словарь, где ключи — номера параграфов и таблиц, а значения — их содержимое
         """
-        doc = Document(self.path)  # Открываем документ по указанному пути
         content = {}  # Создаём словарь для хранения содержимого документа
+        paragraph_index = 0
+        table_index = 0
+        for block in self.iter_blocks(include_unreferenced_images=False):
+            if block[0] == 'paragraph':
+                paragraph_index += 1
+                content[f'Параграф{paragraph_index}'] = block[1]  # Сохраняем текст параграфа с ключом "ПараграфN"
+            elif block[0] == 'table':
+                table_index += 1
+                rows = block[1]
+                # Первая строка - заголовки, остальные - данные
+                content[f'Таблица{table_index}'] = {'headers': rows[0] if rows else [], 'data': rows[1:]}
 
-        # Извлекаем текст из всех параграфов
-        for i, paragraph in enumerate(doc.paragraphs, start=1):
-            content[f'Параграф{i}'] = paragraph.text  # Сохраняем текст параграфа с ключом "ПараграфN"
+        return content  # Возвращаем словарь с содержимым документа
 
-        # Извлекаем данные из всех таблиц
-        for table_index, table in enumerate(doc.tables, start=1):
-            headers = [cell.text.strip() for cell in table.rows[0].cells]  # Извлекаем заголовки из первой строки таблицы
-            data = []  # Создаём список для хранения данных таблицы
-            for row in table.rows[1:]:  # Проходим по всем строкам таблицы, кроме заголовков
-                row_data = [cell.text.strip() for cell in row.cells]  # Извлекаем данные из ячеек строки
-                data.append(row_data)  # Добавляем данные строки в список
-            content[f'Таблица{table_index}'] = {'headers': headers, 'data': data}  # Сохраняем данные таблицы с ключом "ТаблицаN"
+    def images_from_docx(self):
+        """
+        Читает изображения из архива .docx (word/media) прямо в память, без записи на диск.
+        :return: Список пар (имя файла, байты изображения) в порядке номеров (image1, image2, ...)
+        """
+        try:
+            with zipfile.ZipFile(self.path) as archive:
+                names = [
+                    name for name in archive.namelist()
+                    if name.startswith('word/media/') and name.lower().endswith(VALID_IMAGE_EXTENSIONS)
+                ]
+                # Натуральная сортировка: image2 идёт раньше image10
+                names.sort(key=_natural_key)
+                images = [(os.path.basename(name), archive.read(name)) for name in names]
+        except Exception as e:
+            print(f"Ошибка при извлечении изображений: {e}")
+            return []
 
-        return content  # Возвращаем словарь с содержимым документа
+        if images:
+            print(f"Найдено {len(images)} изображений: {', '.join(name for name, _ in images)}")
+        else:
+            print("Изображения не найдены в документе")
+        return images
 
-    def det_image_from_docx(self, output_dir="./images"):
+    def det_image_from_docx(self, output_dir=None):
         """
-        Извлекает изображения из .docx файла и возвращает список путей к сохранённым изображениям.
-        :param output_dir: Директория для сохранения изображений (по умолчанию текущая директория)
+        Сохраняет изображения из .docx на диск (для отладки) и возвращает список путей к ним.
+        В основном пути обработки не используется - см. images_from_docx.
+        :param output_dir: Директория для сохранения изображений (по умолчанию self.image_dir)
         :return: Список путей к изображениям
         """
+        output_dir = output_dir or self.image_dir
         try:
-            # Проверяем, существует ли директория, и создаём её, если она отсутствует
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-
-            # Извлекаем изображения с помощью docx2txt
-            # Изображения автоматически сохраняются в output_dir с именами image{число}.{расширение}
-            docx2txt.process(self.path, output_dir)
-
-            # Получаем список всех файлов в директории
-            files_in_dir = os.listdir(output_dir)
-            image_paths = []  # Создаём список для хранения путей к изображениям
-
-            # Определяем допустимые расширения изображений
-            valid_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-            for file_name in files_in_dir:
-                # Проверяем, начинается ли имя файла с 'image' и имеет ли он допустимое расширение
-                if file_name.startswith('image') and any(file_name.lower().endswith(ext) for ext in valid_extensions):
-                    image_paths.append(os.path.join(output_dir, file_name))  # Добавляем полный путь к изображению
-
-            # Сортируем пути для упорядоченного вывода (например, image1.png, image2.jpg)
-            image_paths.sort()
-
-            # Выводим информацию о найденных изображениях
-            if image_paths:
-                print(f"Найдено {len(image_paths)} изображений:")
-                for path in image_paths:
-                    print(f" - {path}")
-            else:
-                print("Изображения не найдены в документе")
-
-            return image_paths  # Возвращаем список путей к изображениям
-
+            os.makedirs(output_dir, exist_ok=True)
+            image_paths = []
+            for name, data in self.images_from_docx():
+                path = os.path.join(output_dir, name)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                image_paths.append(path)
+            return image_paths
         except Exception as e:
-            print(f"Ошибка при извлечении изображений: {e}")
-            return []  # Возвращаем пустой список в случае ошибки
+            print(f"Ошибка при сохранении изображений: {e}")
+            return []
 
     def make_description(self):
         """
         Формирует текстовое описание документа, включая текст, таблицы и описания изображений.
+        Документ читается за один проход (iter_blocks), результат собирается списком строк:
+        непустые параграфы - как есть, таблицы - в markdown.
+        Неудачные описания и OCR изображений записываются в self.errors.
         :return: Строку с описанием содержимого документа и изображений
         """
-        text = self.text_extract()  # Извлекаем текст и таблицы из документа
-        images_paths = self.det_image_from_docx()  # Извлекаем пути к изображениям
-        describe_images = [ImageExtractions(path).gpt_describe() for path in images_paths]  # Получаем описания изображений с помощью ImageExtractions
-
-        docx_data = ''  # Создаём пустую строку для хранения результата
-        count = 1  # Счётчик для нумерации описаний изображений
-        for i in text.items():  # Перебираем элементы словаря с текстом и таблицами
-            docx_data += f'{i}\n'  # Добавляем текст или таблицу в результат
-        for i in describe_images:  # Перебираем описания изображений
-            docx_data += f'Описание картинки{count}: {i}\n'  # Добавляем описание изображения с номером
-            count += 1  # Увеличиваем счётчик
-
-        return docx_data  # Возвращаем итоговую строку с описанием
\ No newline at end of file
+        # Описание и OCR изображений (PIL, клиент модели, Tesseract) нужны только здесь:
+        # для text_extract и iter_blocks эти зависимости не загружаются
+        from doc_extract.images_descriptions import describe_images, save_debug_image
+        from doc_extract.ocr_engine import get_ocr_engine
+
+        self.errors = []
+        lines = []  # Строки результата в порядке документа
+        images = []  # Изображения в порядке появления в документе
+        paragraph_index = 0
+        table_index = 0
+        with metrics.span('docx.parse') as span:
+            for block in self.iter_blocks():
+                if block[0] == 'paragraph':
+                    paragraph_index += 1
+                    text = block[1].strip()
+                    if text:  # Пустые параграфы в описание не попадают
+                        lines.append(text)
+                elif block[0] == 'table':
+                    table_index += 1
+                    table = rows_markdown(block[1])
+                    if table:
+                        lines.append(f'Таблица {table_index}:\n{table}')
+                else:
+                    _, name, data = block
+                    save_debug_image(data, name)  # Копия на диск только при включённой отладке
+                    images.append(data)
+            span.update(paragraphs=paragraph_index, tables=table_index, images=len(images))
+
+        if images:
+            print(f"Найдено {len(images)} изображений")
+        captions = describe_images(images)  # Получаем описания изображений параллельно
+        for count, caption in enumerate(captions, start=1):
+            if caption.status != 'ok':
+                self.errors.append(f"описание картинки{count}: {caption.error}")
+            lines.append(f'Описание картинки{count}: {caption.text}')  # Добавляем описание изображения с номером
+
+        if self.ocr_images and images:
+            # Текст на изображениях распознаётся пакетно тем же движком, что и для PDF
+            for count, result in enumerate(get_ocr_engine().recognize_many(images), start=1):
+                if result.status != 'ok':
+                    self.errors.append(f"OCR картинки{count}: {result.status} ({result.error})")
+                elif result.text:
+                    lines.append(f'Текст на картинке{count}: {result.text}')
+
+        return ''.join(f'{line}\n' for line in lines)  # Возвращаем итоговую строку с описанием
@@ -0,0 +1,74 @@
+import os
+import importlib
+import threading
+
+_lock = threading.Lock()
+
+
+class FormatBackend:
+    """
+    Обработчик формата файлов.
+    Модуль обработчика импортируется при первом обращении (load), поэтому
+    процесс, которому нужен только DOCX, не загружает pdfplumber, pdf2image
+    и Tesseract, а импорт model.model не тянет ни одного экстрактора.
+    """
+
+    def __init__(self, kind, extensions, module):
+        """
+        :param kind: Вид формата ('image', 'pdf', 'docx')
+        :param extensions: Расширения файлов с точкой, в нижнем регистре
+        :param module: Имя модуля обработчика
+        """
+        self.kind = kind
+        self.extensions = tuple(extensions)
+        self.module_name = module
+        self._module = None
+
+    def load(self):
+        """
+        Импортирует модуль обработчика (один раз).
+        :raises ImportError: если зависимости обработчика не установлены
+        """
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.module_name)
+        return self._module
+
+    def available(self):
+        """Проверяет, можно ли загрузить обработчик."""
+        try:
+            self.load()
+            return True
+        except ImportError as e:
+            print(f"Модуль {self.module_name} недоступен: {e}")
+            return False
+
+
+_formats = {}
+
+
+def register_format(kind, extensions, module):
+    """Регистрирует обработчик формата; модуль не импортируется до первого использования."""
+    backend = FormatBackend(kind, extensions, module)
+    for extension in backend.extensions:
+        _formats[extension] = backend
+    return backend
+
+
+def get_format(file_path):
+    """
+    Находит обработчик по расширению файла.
+    :return: FormatBackend или None для неподдерживаемых файлов
+    """
+    return _formats.get(os.path.splitext(file_path)[1].lower())
+
+
+def supported_extensions(kind=None):
+    """Список поддерживаемых расширений (всех или только указанного вида)."""
+    return [extension for extension, backend in _formats.items() if kind is None or backend.kind == kind]
+
+
+register_format('image', ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'], 'doc_extract.images_descriptions')
+register_format('pdf', ['.pdf'], 'doc_extract.pdf')
+register_format('docx', ['.docx'], 'doc_extract.docx')
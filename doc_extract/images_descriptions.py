@@ -1,84 +1,322 @@
 import os
 import base64
-from g4f.client import Client
-from g4f import Provider
 from PIL import Image
 import io
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from doc_extract.cache import get_image_cache, perceptual_hash, pixel_digest
+from doc_extract.metrics import metrics
+from doc_extract.llm import get_llm_client
+
+# Изображения обрабатываются в памяти; если задан DEBUG_IMAGE_DIR,
+# их копии сохраняются туда для отладки
+DEBUG_IMAGE_DIR = os.environ.get('DEBUG_IMAGE_DIR')
+
+
+def save_debug_image(image, name):
+    """
+    Сохраняет изображение в DEBUG_IMAGE_DIR, если отладочная запись включена.
+    :param image: Изображение PIL или байты файла
+    :param name: Имя файла
+    :return: Путь к сохранённому файлу или None
+    """
+    if not DEBUG_IMAGE_DIR:
+        return None
+    try:
+        os.makedirs(DEBUG_IMAGE_DIR, exist_ok=True)
+        path = os.path.join(DEBUG_IMAGE_DIR, name)
+        if isinstance(image, Image.Image):
+            image.save(path)
+        else:
+            with open(path, 'wb') as f:
+                f.write(bytes(image))
+        return path
+    except Exception as e:
+        print(f"Ошибка при сохранении отладочного изображения {name}: {e}")
+        return None
+
+
+# Размер, до которого модель сама уменьшает изображение: при 'low' - 512x512,
+# при 'high' - вписывает в 2048x2048 и затем сокращает короткую сторону до 768.
+# Отправлять изображение крупнее бессмысленно
+DETAIL_MAX_SIZE = {'low': (512, 512), 'high': (2048, 2048), 'auto': (2048, 2048)}
+HIGH_DETAIL_SHORT_SIDE = 768
+# Во сколько раз промежуточный размер после reduce больше целевого перед BICUBIC
+REDUCING_GAP = 1.5
+# JPEG тяжелее этого (байт на пиксель) пересжимается, даже если размер подходит
+PASSTHROUGH_BYTES_PER_PIXEL = 0.75
+# Описание подбирается по похожему изображению только для небольших изображений
+# (логотипы, печати, подписи): сторона после нормализации не больше этой.
+# Страницы и крупные изображения с текстом ищутся по точному хэшу пикселей
+CAPTION_NEAR_MAX_SIDE = 256
+CAPTION_HASH_SIZE = 16
+CAPTION_MAX_DISTANCE = 1
+
+
+def target_size(size, detail="high", max_size=None):
+    """
+    Размер, до которого нужно уменьшить изображение перед отправкой модели.
+    :param size: Исходный размер (ширина, высота)
+    :param detail: Уровень детализации ('low', 'high', 'auto')
+    :param max_size: Явное ограничение (ширина, высота) вместо ограничений detail
+    :return: (ширина, высота); изображение никогда не увеличивается
+    """
+    width, height = size
+    box = max_size or DETAIL_MAX_SIZE.get(detail, DETAIL_MAX_SIZE['high'])
+    scale = min(1.0, box[0] / width, box[1] / height)
+    if max_size is None and detail != 'low':
+        short_side = min(width, height) * scale
+        if short_side > HIGH_DETAIL_SHORT_SIDE:
+            scale *= HIGH_DETAIL_SHORT_SIDE / short_side
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class CaptionResult:
+    """Результат описания одного изображения: текст и статус ('ok', 'error')."""
+
+    __slots__ = ('text', 'status', 'error')
+
+    def __init__(self, text='', status='ok', error=None):
+        self.text = text
+        self.status = status
+        self.error = error
+
+    def __repr__(self):
+        return f"CaptionResult(status={self.status!r}, chars={len(self.text)})"
+
 
 class ImageExtractions:
     def __init__(self, image_path):
+        """
+        :param image_path: Путь к изображению, уже загруженное изображение PIL или байты файла
+        """
         self.image_path = image_path
-        self.client = Client()
+        # Причина, по которой последнее описание не получено (None - описание получено)
+        self.error = None
+        self.client = get_llm_client()
         self.prompt = """
             Опиши изображение подробно.
             """
 
-    def encode_image(self, max_size=(2048, 2048), quality=85):
+    def _exists(self):
+        """Проверяет, что изображение доступно: объект PIL, байты или существующий файл."""
+        if isinstance(self.image_path, (Image.Image, bytes, bytearray, memoryview)):
+            return True
+        return os.path.exists(self.image_path)
+
+    def _open(self):
+        """Возвращает контекст с изображением, не закрывая переданный извне объект PIL."""
+        if isinstance(self.image_path, Image.Image):
+            return contextlib.nullcontext(self.image_path)
+        if isinstance(self.image_path, (bytes, bytearray, memoryview)):
+            return Image.open(io.BytesIO(self.image_path))
+        return Image.open(self.image_path)
+
+    def _label(self):
+        """Короткое имя изображения для сообщений в консоли."""
+        if isinstance(self.image_path, Image.Image):
+            return f"<изображение {self.image_path.size[0]}x{self.image_path.size[1]}>"
+        if isinstance(self.image_path, (bytes, bytearray, memoryview)):
+            return f"<изображение в памяти, {len(self.image_path)} байт>"
+        return self.image_path
+
+    def _raw_bytes(self):
+        """Исходные байты файла (для пути или байтов) или None для объекта PIL."""
+        if isinstance(self.image_path, Image.Image):
+            return None
+        if isinstance(self.image_path, (bytes, bytearray, memoryview)):
+            return bytes(self.image_path)
+        with open(self.image_path, 'rb') as f:
+            return f.read()
+
+    def _load_normalized(self, size):
+        """
+        Открывает изображение и уменьшает его до size.
+        JPEG декодируется сразу в уменьшенном масштабе (draft), крупное уменьшение
+        выполняется в два шага: быстрое сокращение в целое число раз (reduce),
+        затем BICUBIC до точного размера. Прозрачность заменяется белым фоном.
+        :param size: Целевой размер (ширина, высота) из target_size
+        :return: Изображение PIL в режиме RGB или L (исходный объект не изменяется)
+        """
+        with self._open() as image:
+            if image.size != size and image is not self.image_path:
+                # Декодер JPEG уменьшает в 2, 4 или 8 раз без полного декодирования,
+                # оставляя размер не меньше целевого
+                image.draft(image.mode if image.mode in ('RGB', 'L') else 'RGB', size)
+            if image.mode == 'P':
+                image = image.convert('RGBA')
+            elif image.mode not in ('RGB', 'L', 'RGBA', 'LA'):
+                image = image.convert('RGB')
+
+            if image.size != size:
+                # resize возвращает новый объект - переданное извне изображение не меняется
+                image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=REDUCING_GAP)
+                print(f"Изображение сжато до размера: {image.size}")
+            else:
+                # Загружаем данные до закрытия файла
+                image.load()
+
+            if image.mode in ('RGBA', 'LA'):
+                # Создаем белый фон для прозрачных изображений
+                background = Image.new(image.mode[:-1], image.size, 255 if image.mode == 'LA' else (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            return image
+
+    def _encode(self, detail="high", max_size=None, quality=85, need_image=False):
+        """
+        Готовит изображение к отправке модели.
+        Небольшой JPEG в RGB или оттенках серого, который уже не больше целевого
+        размера, отправляется как есть - без декодирования и повторного сжатия.
+        :param need_image: Вернуть также нормализованное изображение (для перцептивного хэша)
+        :return: (байты JPEG, нормализованное изображение PIL или None)
+        """
+        with self._open() as image:
+            size = target_size(image.size, detail, max_size)
+            passthrough = (image.format == 'JPEG' and image.mode in ('RGB', 'L') and size == image.size
+                           and image is not self.image_path)
+        if passthrough:
+            data = self._raw_bytes()
+            if len(data) <= size[0] * size[1] * PASSTHROUGH_BYTES_PER_PIXEL:
+                metrics.inc('image_encode_total', mode='passthrough')
+                return data, self._load_normalized(size) if need_image else None
+
+        normalized = self._load_normalized(size)
+        buffer = io.BytesIO()
+        normalized.save(buffer, format='JPEG', quality=quality, optimize=True)
+        metrics.inc('image_encode_total', mode='reencode')
+        return buffer.getvalue(), normalized
+
+    @staticmethod
+    def _to_data_url(data):
+        """Возвращает data URL в base64 для байтов JPEG."""
+        return f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def encode_image(self, max_size=None, quality=85, detail="high"):
         """
         Кодирует изображение в формат base64 после сжатия.
-        :param max_size: Максимальный размер изображения (ширина, высота)
+        :param max_size: Максимальный размер изображения (ширина, высота); по умолчанию - по detail
         :param quality: Качество сжатия JPEG (1-100)
+        :param detail: Уровень детализации запроса к модели ('low', 'high', 'auto')
         :return: Строка base64 или None в случае ошибки
         """
-        if not os.path.exists(self.image_path):
-            print(f"Ошибка: Файл {self.image_path} не найден")
+        if not self._exists():
+            print(f"Ошибка: Файл {self._label()} не найден")
             return None
 
         try:
-            # Открываем изображение
-            with Image.open(self.image_path) as image:
-                # Конвертируем в RGB если необходимо
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    # Создаем белый фон для прозрачных изображений
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    if image.mode == 'P':
-                        image = image.convert('RGBA')
-                    background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                    image = background
-                elif image.mode != 'RGB':
-                    image = image.convert('RGB')
-
-                # Изменяем размер если изображение слишком большое
-                if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-                    image.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    print(f"Изображение сжато до размера: {image.size}")
-
-                # Сохраняем в буфер как JPEG
-                buffer = io.BytesIO()
-                image.save(buffer, format='JPEG', quality=quality, optimize=True)
-                buffer.seek(0)
-
-                # Кодируем в base64
-                image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                return f"data:image/jpeg;base64,{image_base64}"
-
+            data, _ = self._encode(detail, max_size, quality)
         except Exception as e:
             print(f"Ошибка при кодировании изображения: {e}")
             return None
+        metrics.observe('image_payload_bytes', len(data), log=False, detail=detail)
+        return self._to_data_url(data)
 
-    def gpt_describe(self, model="gpt-4.1-nano", detail="low"):
-        print(f"Началась обработка: {self.image_path}")
-        if not os.path.exists(self.image_path):
-            print(f"Ошибка: Файл {self.image_path} не найден")
+    def gpt_describe(self, model="gpt-4.1-nano", detail="low", timeout=None, exact=None):
+        """
+        Получает описание изображения от модели.
+        Описания кэшируются: небольшие изображения - по перцептивному хэшу
+        (повторяющиеся логотипы и печати описываются один раз), остальные -
+        по точному хэшу пикселей, чтобы страницы с одинаковым бланком не
+        получали чужое описание.
+        :param timeout: Таймаут попытки запроса в секундах (None - LLM_TIMEOUT)
+        :param exact: Искать описание только по точному хэшу (None - по размеру изображения)
+        :return: Текст описания или сообщение об ошибке (причина ошибки - в self.error)
+        """
+        print(f"Началась обработка: {self._label()}")
+        self.error = None
+        if not self._exists():
+            print(f"Ошибка: Файл {self._label()} не найден")
+            self.error = "изображение не найдено"
             return "Изображение не найдено"
 
-        image_url = self.encode_image()
-        if not image_url:
+        try:
+            data, normalized = self._encode(detail, need_image=True)
+        except Exception as e:
+            print(f"Ошибка при кодировании изображения: {e}")
+            self.error = f"не удалось закодировать изображение: {e}"
             return "Ошибка при кодировании изображения"
 
+        cache = get_image_cache()
+        if exact is None:
+            exact = max(normalized.size) > CAPTION_NEAR_MAX_SIDE
+        if exact:
+            cache_kind, max_distance = f"caption:{model}:{detail}:exact", 0
+        else:
+            cache_kind, max_distance = f"caption:{model}:{detail}:near", CAPTION_MAX_DISTANCE
+        image_hash = None
+        if cache is not None:
+            image_hash = pixel_digest(normalized) if exact else perceptual_hash(normalized, CAPTION_HASH_SIZE)
+            cached = cache.lookup(cache_kind, image_hash, max_distance=max_distance)
+            if cached is not None:
+                print("Описание изображения взято из кэша")
+                return cached
+
+        image_url = self._to_data_url(data)
+        metrics.observe('image_payload_bytes', len(data), log=False, detail=detail)
+
+        metrics.observe('prompt_chars', len(self.prompt) + len(image_url), kind='caption')
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": self.prompt},
-                        {"type": "image_url", "image_url": {"url": image_url, "detail": detail}}
-                    ]
-                }],
-                web_search=True,
-            )
-            return response.choices[0].message.content
+            with metrics.span('caption.request', model=model, detail=detail):
+                description = self.client.complete(
+                    [{
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": self.prompt},
+                            {"type": "image_url", "image_url": {"url": image_url, "detail": detail}}
+                        ]
+                    }],
+                    model=model,
+                    timeout=timeout,
+                    web_search=True,
+                )
+            if cache is not None and description:
+                cache.put(cache_kind, image_hash, description)
+            return description
         except Exception as e:
             print(f"Ошибка при запросе к модели GPT: {e}")
+            self.error = str(e)
             return f"Ошибка при описании изображения: {e}"
+
+
+def describe_images(images, model="gpt-4.1-nano", detail="low", max_concurrency=4, timeout=120, exact=None):
+    """
+    Описывает несколько изображений параллельно с ограничением числа одновременных запросов.
+    :param images: Список путей к файлам, изображений PIL или байтов файлов
+    :param max_concurrency: Максимум одновременных запросов к модели
+    :param timeout: Таймаут каждого запроса в секундах
+    :param exact: Искать описания в кэше только по точному хэшу (см. gpt_describe)
+    :return: Список CaptionResult в том же порядке, что и images; текст неудачного
+             описания - сообщение об ошибке для запроса к модели
+    """
+    images = list(images)
+    if not images:
+        return []
+
+    def describe(image):
+        try:
+            extractor = ImageExtractions(image)
+            description = extractor.gpt_describe(model=model, detail=detail, timeout=timeout, exact=exact)
+        except Exception as e:
+            print(f"Ошибка при получении описания: {e}")
+            return CaptionResult("Описание недоступно", status='error', error=str(e))
+        if extractor.error is not None:
+            return CaptionResult(description, status='error', error=extractor.error)
+        return CaptionResult(description)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(images)))) as pool:
+        # map сохраняет порядок входных данных независимо от порядка завершения
+        results = list(pool.map(describe, images))
+    for result in results:
+        metrics.inc('caption_images_total', status=result.status)
+    return results
+
+
+def describe_many(images, model="gpt-4.1-nano", detail="low", max_concurrency=4, timeout=120, exact=None):
+    """
+    Описывает несколько изображений параллельно (см. describe_images).
+    :return: Список описаний в том же порядке, что и images
+    """
+    return [result.text for result in describe_images(images, model, detail, max_concurrency, timeout, exact)]
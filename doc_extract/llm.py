@@ -0,0 +1,244 @@
+import os
+import time
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from doc_extract.metrics import metrics
+
+_STREAM_END = object()
+
+
+class LlmError(Exception):
+    """Запрос к модели не удался после всех попыток."""
+
+
+class LlmClient:
+    """
+    Общий слой доступа к модели для чата и описаний изображений.
+    Один клиент g4f на процесс (соединения переиспользуются), таймаут на
+    каждую попытку, повторы с экспоненциальной задержкой и случайным
+    разбросом, ограничение числа одновременных запросов и, по желанию,
+    дублирующий запрос, если первый отвечает дольше hedge_after секунд.
+    Запрос выполняется в пуле потоков, поэтому зависший провайдер не
+    держит обработчик Gradio дольше таймаута.
+    """
+
+    def __init__(self, client_factory=None, timeout=120, retries=2, backoff=0.5, max_backoff=8.0,
+                 max_concurrency=16, hedge_after=0):
+        """
+        :param client_factory: Функция, создающая клиент с интерфейсом g4f (по умолчанию g4f.client.Client)
+        :param timeout: Таймаут одной попытки в секундах (для потока - до первого и между фрагментами)
+        :param retries: Число повторов после неудачной попытки
+        :param backoff: Базовая задержка перед повтором в секундах
+        :param max_backoff: Максимальная задержка перед повтором
+        :param max_concurrency: Максимум одновременных запросов к модели
+        :param hedge_after: Через сколько секунд без ответа отправить дублирующий запрос (0 - не отправлять)
+        """
+        self.client_factory = client_factory
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max(1, max_concurrency)
+        self.hedge_after = hedge_after
+        self._client = None
+        self._reset_workers()
+
+    def _reset_workers(self):
+        """
+        Создаёт пул потоков, ограничитель запросов и клиент g4f заново.
+        Вызывается в дочернем процессе после fork: потоки родителя туда не
+        копируются, а занятые ими слоты семафора никогда бы не освободились.
+        """
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # Потоков больше, чем слотов: брошенные по таймауту запросы досчитываются в фоне
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency * 2, thread_name_prefix='llm')
+
+    @property
+    def client(self):
+        """Клиент g4f, создаётся один раз."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    factory = self.client_factory
+                    if factory is None:
+                        # g4f тяжёлый, загружается при первом запросе к модели
+                        from g4f.client import Client as factory
+                    self._client = factory()
+        return self._client
+
+    def _delay(self, attempt):
+        """Задержка перед повтором: случайная в пределах экспоненциально растущего окна."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _submit(self, func, block=True):
+        """
+        Запускает func в пуле, заняв слот ограничителя; слот освобождается, когда запрос завершится.
+        :param block: Ждать свободный слот (не дольше таймаута) или сразу вернуть None
+        """
+        if not self._slots.acquire(blocking=block, timeout=self.timeout if block else None):
+            if block:
+                raise LlmError("превышено время ожидания свободного слота запроса")
+            return None
+        try:
+            future = self._pool.submit(func)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _retrying(self, attempt_func, kind, timeout):
+        """Выполняет attempt_func с повторами; attempt_func() возвращает результат или бросает исключение."""
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.inc('llm_retries_total', kind=kind)
+                time.sleep(self._delay(attempt - 1))
+            try:
+                return attempt_func()
+            except FutureTimeoutError:
+                metrics.inc('llm_timeouts_total', kind=kind)
+                last_error = LlmError(f"нет ответа за {timeout} с")
+            except Exception as e:
+                last_error = e
+            print(f"Запрос к модели не удался (попытка {attempt + 1} из {self.retries + 1}): {last_error}")
+        metrics.inc('llm_failures_total', kind=kind)
+        raise LlmError(str(last_error))
+
+    def _request(self, model, messages, options):
+        response = self.client.chat.completions.create(model=model, messages=messages, **options)
+        content = response.choices[0].message.content
+        if not content:
+            raise LlmError("пустой ответ модели")
+        return content
+
+    def complete(self, messages, model="gpt-4.1-nano", timeout=None, **options):
+        """
+        Отправляет запрос и возвращает текст ответа.
+        :param messages: Сообщения в формате chat.completions
+        :param timeout: Таймаут попытки для этого запроса (по умолчанию self.timeout)
+        :param options: Дополнительные параметры g4f (например, web_search)
+        :raises LlmError: если все попытки не удались
+        """
+        timeout = timeout or self.timeout
+        # Таймаут передаётся и провайдеру, чтобы брошенный запрос не занимал поток дольше нужного
+        options.setdefault('timeout', timeout)
+
+        def attempt():
+            future = self._submit(lambda: self._request(model, messages, options))
+            if not self.hedge_after or self.hedge_after >= timeout:
+                return future.result(timeout=timeout)
+
+            done, _ = wait([future], timeout=self.hedge_after)
+            if done:
+                return future.result()
+            # Первый запрос задерживается - отправляем дубль, если есть свободный слот
+            hedge = self._submit(lambda: self._request(model, messages, options), block=False)
+            if hedge is None:
+                return future.result(timeout=timeout - self.hedge_after)
+            metrics.inc('llm_hedges_total')
+            pending = {future, hedge}
+            deadline = time.monotonic() + timeout - self.hedge_after
+            while pending:
+                done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise FutureTimeoutError()
+                for finished in done:
+                    if finished.exception() is None:
+                        return finished.result()
+            # Обе попытки завершились ошибкой
+            return future.result()
+
+        return self._retrying(attempt, 'complete', timeout)
+
+    def stream(self, messages, model="gpt-4.1-nano", timeout=None, **options):
+        """
+        Отправляет потоковый запрос и отдаёт фрагменты ответа по мере генерации.
+        Повтор возможен только до первого фрагмента: после него ответ уже показан пользователю.
+        :raises LlmError: если ответ не начался после всех попыток или поток оборвался
+        """
+        timeout = timeout or self.timeout
+        options.setdefault('timeout', timeout)
+
+        def produce(chunks):
+            try:
+                for chunk in self.client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                                 **options):
+                    if chunk.choices:
+                        token = chunk.choices[0].delta.content
+                        if token:
+                            chunks.put(token)
+                chunks.put(_STREAM_END)
+            except Exception as e:
+                chunks.put(e)
+
+        def first_chunk():
+            # Для каждой попытки своя очередь: опоздавшая попытка не смешает фрагменты
+            attempt_chunks = queue.Queue()
+            self._submit(lambda: produce(attempt_chunks))
+            try:
+                item = attempt_chunks.get(timeout=timeout)
+            except queue.Empty:
+                raise FutureTimeoutError()
+            if isinstance(item, Exception):
+                raise item
+            return item, attempt_chunks
+
+        item, chunks = self._retrying(first_chunk, 'stream', timeout)
+        while item is not _STREAM_END:
+            yield item
+            try:
+                item = chunks.get(timeout=timeout)
+            except queue.Empty:
+                metrics.inc('llm_timeouts_total', kind='stream')
+                raise LlmError(f"поток ответа прервался: нет данных {timeout} с")
+            if isinstance(item, Exception):
+                raise LlmError(f"поток ответа прервался: {item}")
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """
+    Возвращает общий клиент модели.
+    Настройки: LLM_TIMEOUT, LLM_RETRIES, LLM_BACKOFF, LLM_MAX_CONCURRENCY,
+    LLM_HEDGE_AFTER (секунд до дублирующего запроса, 0 - выключено).
+    """
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = LlmClient(
+                    timeout=float(os.environ.get('LLM_TIMEOUT', 120)),
+                    retries=int(os.environ.get('LLM_RETRIES', 2)),
+                    backoff=float(os.environ.get('LLM_BACKOFF', 0.5)),
+                    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 16)),
+                    hedge_after=float(os.environ.get('LLM_HEDGE_AFTER', 0)),
+                )
+    return _llm_client
+
+
+def set_llm_client(client):
+    """Подменяет общий клиент (тесты, бенчмарки, локальная заглушка)."""
+    global _llm_client
+    with _llm_client_lock:
+        _llm_client = client
+
+
+def _after_fork_in_child():
+    # Процессы пула обработки PDF наследуют общий клиент вместе с потоками, которых у них нет
+    global _llm_client_lock
+    _llm_client_lock = threading.Lock()
+    if isinstance(_llm_client, LlmClient):
+        _llm_client._reset_workers()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+# Границы корзин гистограмм: длительности в секундах и размеры (символы, токены)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (100, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 500000)
+
+PREFIX = 'docanalyzer_'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """
+    Счётчики и гистограммы по этапам обработки.
+    Метрики хранятся в памяти процесса и отдаются в текстовом формате
+    Prometheus (render). Замеры этапов (span) и наблюдения дополнительно
+    пишутся строками JSON в METRICS_LOG ('-' - в stdout), если он задан.
+    Процессы пула обработки PDF возвращают snapshot(), который
+    основной процесс добавляет к своим метрикам через merge().
+    """
+
+    def __init__(self, log_path=None):
+        """:param log_path: Файл JSON-лога (по умолчанию METRICS_LOG; пусто - лог не пишется)"""
+        self.log_path = log_path if log_path is not None else os.environ.get('METRICS_LOG', '')
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Обнуляет все метрики (в процессе пула - перед обработкой отрезка)."""
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Увеличивает счётчик name с метками labels."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SIZE_BUCKETS, log=True, **labels):
+        """Добавляет наблюдение в гистограмму name и пишет его в JSON-лог."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+        if log:
+            self.log({'event': name, 'value': value, **labels})
+
+    @contextlib.contextmanager
+    def span(self, stage, **labels):
+        """
+        Замеряет длительность этапа.
+        Результат попадает в гистограмму stage_duration_seconds{stage, status}
+        и в JSON-лог. Внутри блока можно дополнить метки: span['pages'] = 5.
+        """
+        extra = {}
+        status = 'ok'
+        start = time.perf_counter()
+        try:
+            yield extra
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.record_span(stage, time.perf_counter() - start, status, **labels, **extra)
+
+    def record_span(self, stage, seconds, status='ok', **labels):
+        """
+        Учитывает уже измеренную длительность этапа (когда этап нельзя обернуть в span,
+        например потоковую обработку). Метки labels попадают только в JSON-лог.
+        """
+        self.observe('stage_duration_seconds', seconds, buckets=DURATION_BUCKETS, log=False,
+                     stage=stage, status=status)
+        self.log({'event': 'span', 'stage': stage, 'status': status, 'seconds': round(seconds, 6), **labels})
+
+    def log(self, record):
+        """Пишет запись строкой JSON в METRICS_LOG."""
+        if not self.log_path:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'pid': os.getpid(), **record},
+                          ensure_ascii=False, default=str)
+        with self._log_lock:
+            try:
+                if self.log_path == '-':
+                    print(line, flush=True)
+                else:
+                    with open(self.log_path, 'a', encoding='utf-8') as f:
+                        f.write(line + '\n')
+            except OSError as e:
+                print(f"Ошибка записи лога метрик: {e}")
+
+    def snapshot(self):
+        """Возвращает копию метрик, пригодную для передачи между процессами."""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {
+                    key: (h.buckets, list(h.counts), h.count, h.sum) for key, h in self._histograms.items()
+                },
+            }
+
+    def merge(self, snapshot):
+        """Добавляет метрики из snapshot() другого процесса."""
+        if not snapshot:
+            return
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (buckets, counts, count, total) in snapshot['histograms'].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = _Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (
+            f'{k}="' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for k, v in pairs
+        )
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        """Возвращает метрики в текстовом формате Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (h.buckets, list(h.counts), h.count, h.sum)) for key, h in self._histograms.items()
+            )
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            full = f"{PREFIX}{name}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter")
+                typed.add(full)
+            lines.append(f"{full}{self._labels(labels)} {value}")
+
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            full = f"{PREFIX}{name}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} histogram")
+                typed.add(full)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{full}_bucket{self._labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{full}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{full}_sum{self._labels(labels)} {total}")
+            lines.append(f"{full}_count{self._labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Запускает HTTP-сервер с метриками (/metrics) в фоновом потоке.
+    :param port: Порт (по умолчанию METRICS_PORT или 9464; 0 - не запускать)
+    :param host: Адрес (по умолчанию METRICS_HOST или 0.0.0.0)
+    :return: Сервер или None
+    """
+    # http.server заметно замедляет импорт, а нужен только веб-приложению
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Запросы сборщика метрик не засоряют вывод
+            pass
+
+    port = int(port if port is not None else os.environ.get('METRICS_PORT', 9464))
+    if not port:
+        return None
+    host = host or os.environ.get('METRICS_HOST', '0.0.0.0')
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
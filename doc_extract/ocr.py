@@ -0,0 +1,127 @@
+from pdfminer.layout import LTFigure, LTChar, LTTextContainer
+
+
+class OcrPlan:
+    """
+    План OCR для одной страницы PDF.
+    regions - области изображений в координатах страницы (x0, top, x1, bottom),
+    отсчёт сверху, в пунктах; dpi - разрешение растеризации для OCR;
+    embedded_text - текст, который уже есть внутри изображений (OCR для него не нужен).
+    """
+
+    def __init__(self, page_width, page_height, regions=None, dpi=None, embedded_text=''):
+        self.page_width = page_width
+        self.page_height = page_height
+        self.regions = regions or []
+        self.dpi = dpi
+        self.embedded_text = embedded_text
+
+    @property
+    def needs_ocr(self):
+        return bool(self.regions)
+
+    def crop_boxes(self, image):
+        """
+        Переводит области плана в пиксельные координаты растеризованной страницы.
+        :param image: Изображение PIL всей страницы
+        :return: Список (left, upper, right, lower) для Image.crop
+        """
+        scale_x = image.width / self.page_width
+        scale_y = image.height / self.page_height
+        boxes = []
+        for x0, top, x1, bottom in self.regions:
+            box = (
+                max(0, int(x0 * scale_x)),
+                max(0, int(top * scale_y)),
+                min(image.width, int(round(x1 * scale_x))),
+                min(image.height, int(round(bottom * scale_y))),
+            )
+            if box[2] > box[0] and box[3] > box[1]:
+                boxes.append(box)
+        return boxes
+
+
+class OcrPlanner:
+    """
+    Решает по разметке pdfminer, нужен ли странице OCR и для каких областей.
+    OCR пропускается для мелких изображений (логотипы, печати) и для
+    изображений, внутри которых уже есть текстовый слой. Для остальных
+    распознаются только области изображений, а разрешение подбирается
+    по размеру области: мелкие области рендерятся крупнее, чтобы мелкий
+    текст распознавался, крупные - в обычном для OCR разрешении.
+    """
+
+    def __init__(self, min_area_ratio=0.02, small_area_ratio=0.25, full_text_chars=200,
+                 base_dpi=300, small_region_dpi=400, max_region_pixels=4000):
+        """
+        :param min_area_ratio: Изображения меньше этой доли страницы не распознаются
+        :param small_area_ratio: На страницах с полным текстовым слоем не распознаются изображения меньше этой доли
+        :param full_text_chars: Число символов, начиная с которого текстовый слой считается полным
+        :param base_dpi: Разрешение OCR для крупных областей (сканы страниц)
+        :param small_region_dpi: Разрешение OCR для небольших областей
+        :param max_region_pixels: Ограничение на длинную сторону области в пикселях
+        """
+        self.min_area_ratio = min_area_ratio
+        self.small_area_ratio = small_area_ratio
+        self.full_text_chars = full_text_chars
+        self.base_dpi = base_dpi
+        self.small_region_dpi = small_region_dpi
+        self.max_region_pixels = max_region_pixels
+
+    @staticmethod
+    def _figure_text(figure):
+        """Собирает текст символов, вложенных в изображение (LTFigure)."""
+        parts = []
+        for element in figure:
+            if isinstance(element, LTChar):
+                parts.append(element.get_text())
+            elif isinstance(element, LTTextContainer):
+                parts.append(element.get_text())
+            elif isinstance(element, LTFigure):
+                parts.append(OcrPlanner._figure_text(element))
+        return ''.join(parts).strip()
+
+    def plan(self, page):
+        """
+        Строит план OCR для страницы.
+        :param page: LTPage из pdfminer
+        :return: OcrPlan
+        """
+        page_width, page_height = page.width, page.height
+        page_area = max(page_width * page_height, 1.0)
+
+        text_chars = 0
+        figures = []
+        for element in page:
+            if isinstance(element, LTTextContainer):
+                text_chars += len(element.get_text().strip())
+            elif isinstance(element, LTFigure):
+                figures.append(element)
+
+        has_text_layer = text_chars >= self.full_text_chars
+        regions = []
+        embedded = []
+        dpi = None
+        for figure in figures:
+            area_ratio = (figure.width * figure.height) / page_area
+
+            # Текст внутри изображения уже векторный - берём его без OCR
+            figure_text = self._figure_text(figure)
+            if figure_text:
+                embedded.append(figure_text)
+                continue
+
+            if area_ratio < self.min_area_ratio:
+                continue
+            if has_text_layer and area_ratio < self.small_area_ratio:
+                continue
+
+            regions.append((figure.x0 - page.x0, page.y1 - figure.y1, figure.x1 - page.x0, page.y1 - figure.y0))
+            region_dpi = self.base_dpi if area_ratio >= self.small_area_ratio else self.small_region_dpi
+            # Не раздуваем область сверх max_region_pixels по длинной стороне
+            longest_inch = max(figure.width, figure.height) / 72
+            if longest_inch > 0:
+                region_dpi = min(region_dpi, max(72, int(self.max_region_pixels / longest_inch)))
+            dpi = max(dpi or 0, region_dpi)
+
+        return OcrPlan(page_width, page_height, regions, dpi, '\n'.join(embedded))
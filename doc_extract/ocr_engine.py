@@ -0,0 +1,219 @@
+import io
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from doc_extract.cache import get_image_cache, pixel_digest
+from doc_extract.metrics import metrics
+
+
+class OcrResult:
+    """Результат OCR одного изображения: текст и статус ('ok', 'timeout', 'error')."""
+
+    __slots__ = ('text', 'status', 'error')
+
+    def __init__(self, text='', status='ok', error=None):
+        self.text = text
+        self.status = status
+        self.error = error
+
+    def __repr__(self):
+        return f"OcrResult(status={self.status!r}, chars={len(self.text)})"
+
+
+class OcrEngine:
+    """
+    Пакетное выполнение Tesseract.
+    Вместо запуска процесса на каждое изображение (как pytesseract.image_to_string)
+    изображения группируются в пакеты: один процесс tesseract получает список
+    файлов, языковые модели загружаются один раз на пакет, а текст страниц
+    разделяется символом перевода страницы. Пакеты выполняются параллельно
+    в нескольких процессах. Если пакет упал или превысил таймаут, его
+    изображения распознаются по одному, чтобы у каждого был свой статус.
+    """
+
+    def __init__(self, lang='rus+eng', workers=None, batch_size=8, timeout=60, config=''):
+        """
+        :param lang: Языки Tesseract
+        :param workers: Число одновременно работающих процессов tesseract (по умолчанию - число ядер)
+        :param batch_size: Число изображений в одном запуске tesseract
+        :param timeout: Таймаут на одно изображение в секундах
+        :param config: Дополнительные параметры командной строки tesseract
+        """
+        self.lang = lang
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.config = config
+
+    def _command(self, input_path):
+        import pytesseract
+
+        cmd = [pytesseract.pytesseract.tesseract_cmd, input_path, 'stdout', '-l', self.lang]
+        if self.config:
+            cmd.extend(self.config.split())
+        return cmd
+
+    def _run(self, input_path, timeout):
+        """Запускает tesseract и возвращает stdout; ошибки пробрасываются."""
+        env = dict(os.environ)
+        # Параллелизм обеспечивают процессы пула, внутренние потоки tesseract только мешают
+        env.setdefault('OMP_THREAD_LIMIT', '1')
+        completed = subprocess.run(self._command(input_path), capture_output=True, timeout=timeout, env=env)
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.decode('utf-8', errors='replace').strip() or 'tesseract error')
+        return completed.stdout.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def _write_image(image, path):
+        # PNG не поддерживает CMYK, YCbCr и т.п. - такие изображения приводятся к RGB или L
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('L' if image.mode in ('I', 'I;16', 'F') else 'RGB')
+        # PNG с минимальным сжатием: кодирование быстрое, tesseract читает без потерь
+        image.save(path, format='PNG', compress_level=1)
+
+    def _recognize_one(self, image, tmp_dir, index):
+        path = os.path.join(tmp_dir, f"single_{index}.png")
+        try:
+            self._write_image(image, path)
+            return OcrResult(self._run(path, self.timeout).replace('\f', '').strip())
+        except subprocess.TimeoutExpired:
+            return OcrResult(status='timeout', error=f"превышен таймаут {self.timeout} с")
+        except Exception as e:
+            return OcrResult(status='error', error=str(e))
+
+    def _recognize_batch(self, images):
+        """Распознаёт пакет изображений одним запуском tesseract."""
+        with metrics.span('ocr', images=len(images)):
+            results = self._recognize_batch_files(images)
+        for result in results:
+            metrics.inc('ocr_images_total', status=result.status)
+        return results
+
+    def _recognize_batch_files(self, images):
+        results = [None] * len(images)
+        with tempfile.TemporaryDirectory(prefix='ocr_') as tmp_dir:
+            # Изображение, которое не удалось записать (повреждённое, неподдерживаемый режим),
+            # получает статус 'error', остальные изображения пакета распознаются
+            written = []  # (индекс, изображение, путь)
+            for i, image in enumerate(images):
+                path = os.path.join(tmp_dir, f"page_{i}.png")
+                try:
+                    self._write_image(image, path)
+                except Exception as e:
+                    results[i] = OcrResult(status='error', error=f"не удалось подготовить изображение: {e}")
+                    continue
+                written.append((i, image, path))
+
+            for (i, _, _), result in zip(written, self._recognize_files(written, tmp_dir)):
+                results[i] = result
+        return results
+
+    def _recognize_files(self, written, tmp_dir):
+        """
+        Распознаёт записанные изображения пакетом, при сбое пакета - по одному.
+        :param written: Список (индекс, изображение, путь к PNG)
+        :return: Список OcrResult в том же порядке
+        """
+        if not written:
+            return []
+        images = [image for _, image, _ in written]
+        paths = [path for _, _, path in written]
+        if len(images) > 1:
+            list_path = os.path.join(tmp_dir, 'list.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(paths) + '\n')
+            try:
+                pages = self._run(list_path, self.timeout * len(images)).split('\f')
+                # После последней страницы tesseract тоже ставит разделитель
+                if len(pages) == len(images) + 1 and not pages[-1].strip():
+                    pages = pages[:-1]
+                if len(pages) == len(images):
+                    return [OcrResult(page.strip()) for page in pages]
+                print(f"OCR: пакет вернул {len(pages)} страниц вместо {len(images)}, распознаю по одной")
+            except subprocess.TimeoutExpired:
+                print("OCR: пакет превысил таймаут, распознаю по одной")
+            except Exception as e:
+                print(f"OCR: ошибка пакета ({e}), распознаю по одной")
+
+        return [self._recognize_one(image, tmp_dir, i) for i, image in enumerate(images)]
+
+    @staticmethod
+    def _to_image(image):
+        if isinstance(image, Image.Image):
+            return image
+        if isinstance(image, (bytes, bytearray)):
+            return Image.open(io.BytesIO(image))
+        return Image.open(image)
+
+    def recognize_many(self, images):
+        """
+        Распознаёт текст на нескольких изображениях.
+        Уже распознанные изображения (с теми же пикселями) берутся из кэша,
+        остальные - пакетами в пуле.
+        :param images: Список изображений PIL, байтов или путей к файлам
+        :return: Список OcrResult в том же порядке
+        """
+        results = [None] * len(images)
+        cache = get_image_cache()
+        # Записи прежнего вида "ocr:<языки>" хранились по перцептивному хэшу и не используются
+        cache_kind = f"ocr:{self.lang}:exact"
+        pending = []  # (индекс, изображение, хэш)
+
+        for i, image in enumerate(images):
+            try:
+                img = self._to_image(image)
+                # Только точный хэш пикселей: перцептивный совпадает у страниц, отличающихся
+                # одной суммой или датой. Хэш декодирует изображение: повреждённый файл проявится здесь
+                image_hash = pixel_digest(img) if cache is not None else None
+            except Exception as e:
+                results[i] = OcrResult(status='error', error=f"не удалось открыть изображение: {e}")
+                continue
+
+            if cache is not None:
+                cached = cache.lookup(cache_kind, image_hash, max_distance=0)
+                if cached is not None:
+                    results[i] = OcrResult(cached)
+                    continue
+            pending.append((i, img, image_hash))
+
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as pool:
+                batch_results = pool.map(lambda batch: self._recognize_batch([img for _, img, _ in batch]), batches)
+                for batch, recognized in zip(batches, batch_results):
+                    for (i, _, image_hash), result in zip(batch, recognized):
+                        results[i] = result
+                        if result.status != 'ok':
+                            print(f"OCR изображения {i + 1}: {result.status} ({result.error})")
+                        elif cache is not None:
+                            cache.put(cache_kind, image_hash, result.text)
+
+        return results
+
+    def recognize(self, image):
+        """Распознаёт одно изображение."""
+        return self.recognize_many([image])[0]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine():
+    """
+    Возвращает общий OCR-движок.
+    Настройки: OCR_WORKERS, OCR_BATCH_SIZE, OCR_TIMEOUT (секунд на изображение).
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = OcrEngine(
+                    workers=int(os.environ.get('OCR_WORKERS', 0)) or None,
+                    batch_size=int(os.environ.get('OCR_BATCH_SIZE', 8)),
+                    timeout=int(os.environ.get('OCR_TIMEOUT', 60)),
+                )
+    return _engine
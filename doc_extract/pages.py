@@ -0,0 +1,158 @@
+import sys
+from array import array
+from collections.abc import Mapping
+
+
+class FontTable:
+    """
+    Общая таблица шрифтов документа.
+    Каждая пара (шрифт, размер) хранится один раз, страницы ссылаются на неё
+    по номеру. Имена шрифтов интернируются, поэтому одинаковые строки
+    не дублируются между страницами.
+    """
+
+    __slots__ = ('_fonts', '_ids')
+
+    def __init__(self):
+        self._fonts = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._fonts)
+
+    def __getitem__(self, font_id):
+        return self._fonts[font_id]
+
+    def intern(self, fontname, size):
+        """Возвращает номер пары (шрифт, размер), добавляя её при первом появлении."""
+        key = (fontname, size)
+        font_id = self._ids.get(key)
+        if font_id is None:
+            font_id = len(self._fonts)
+            font = (sys.intern(fontname) if isinstance(fontname, str) else fontname, size)
+            self._fonts.append(font)
+            self._ids[font] = font_id
+        return font_id
+
+    def __getstate__(self):
+        return self._fonts
+
+    def __setstate__(self, fonts):
+        self._fonts = [(sys.intern(name) if isinstance(name, str) else name, size) for name, size in fonts]
+        self._ids = {font: font_id for font_id, font in enumerate(self._fonts)}
+
+
+class PageRecord(Mapping):
+    """
+    Компактные данные страницы PDF.
+    Текст хранится одной строкой, форматы - отрезками: номер шрифта в
+    FontTable и длина отрезка в символах текста (массивы array вместо
+    кортежа на каждый символ). Снаружи запись ведёт себя как прежний
+    словарь {'text', 'images', 'tables', 'formats'}, поэтому код, который
+    читает page_data['text'] или page_data.get('images', []), не меняется.
+    Ошибки описания и OCR изображений страницы копятся в errors (в словарь
+    не входят): страницы с ошибками не кэшируются.
+    """
+
+    __slots__ = ('text', 'images', 'tables', 'fonts', 'font_ids', 'font_runs', 'errors')
+
+    _KEYS = ('text', 'images', 'tables', 'formats')
+
+    def __init__(self, text='', fonts=None, font_ids=None, font_runs=None, images=None, tables=None, errors=None):
+        self.text = text
+        self.fonts = fonts if fonts is not None else FontTable()
+        self.font_ids = font_ids if font_ids is not None else array('I')
+        self.font_runs = font_runs if font_runs is not None else array('I')
+        self.images = images if images is not None else []
+        self.tables = tables if tables is not None else []
+        self.errors = errors if errors is not None else []
+
+    @property
+    def formats(self):
+        """Уникальные пары (шрифт, размер) страницы - как прежнее поле 'formats'."""
+        return [self.fonts[font_id] for font_id in sorted(set(self.font_ids))]
+
+    def spans(self):
+        """
+        Перебирает отрезки текста с одинаковым шрифтом.
+        :return: Генератор кортежей (начало, конец, шрифт, размер) в символах self.text
+        """
+        start = 0
+        for font_id, length in zip(self.font_ids, self.font_runs):
+            fontname, size = self.fonts[font_id]
+            yield start, start + length, fontname, size
+            start += length
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def to_dict(self):
+        """Возвращает данные страницы обычным словарём."""
+        return {key: self[key] for key in self._KEYS}
+
+    def __repr__(self):
+        # Совпадает с представлением прежнего словаря: оно попадает в запрос к модели
+        return repr(self.to_dict())
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+
+class PageBuilder:
+    """
+    Собирает PageRecord по мере разбора страницы.
+    Куски текста копятся в списке и склеиваются один раз в build(),
+    а шрифты соседних символов сворачиваются в отрезки на лету.
+    """
+
+    __slots__ = ('fonts', '_parts', '_font_ids', '_font_runs', '_pending')
+
+    def __init__(self, fonts):
+        """:param fonts: FontTable, общая для страниц документа"""
+        self.fonts = fonts
+        self._parts = []
+        self._font_ids = array('I')
+        self._font_runs = array('I')
+        # Символы до первого шрифта (например, ведущие пробелы) - присоединяются к первому отрезку
+        self._pending = 0
+
+    def append(self, text, fontname=None, size=None):
+        """
+        Добавляет кусок текста.
+        :param fontname: Шрифт куска; None - продолжение текущего отрезка (пробелы, переводы строк)
+        """
+        if not text:
+            return
+        self._parts.append(text)
+        length = len(text)
+
+        if fontname is None:
+            if self._font_runs:
+                self._font_runs[-1] += length
+            else:
+                self._pending += length
+            return
+
+        font_id = self.fonts.intern(fontname, size)
+        if self._font_ids and self._font_ids[-1] == font_id:
+            self._font_runs[-1] += length
+        else:
+            self._font_ids.append(font_id)
+            self._font_runs.append(length + self._pending)
+            self._pending = 0
+
+    def build(self):
+        """Возвращает готовую запись страницы."""
+        return PageRecord(''.join(self._parts), self.fonts, self._font_ids, self._font_runs)
@@ -1,80 +1,269 @@
 import pdfplumber
 from pdf2image import convert_from_path
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextContainer, LTChar, LTFigure
+from pdfminer.layout import LTTextContainer, LTChar, LTAnno, LTFigure, LTContainer, LTCurve, LTLine, LTRect
 from PIL import Image
-import pytesseract
 import os
-from doc_extract.images_descriptions import ImageExtractions
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from doc_extract.images_descriptions import describe_images, save_debug_image, target_size, REDUCING_GAP
+from doc_extract.ocr import OcrPlanner
+from doc_extract.ocr_engine import get_ocr_engine, OcrResult
+from doc_extract.pages import FontTable, PageBuilder
+from doc_extract.metrics import metrics
 
 
-class PdfExtraction:
-    def __init__(self):
-        """Инициализирует класс PdfExtraction."""
-        if not os.path.exists('images'):
-            os.makedirs('images')
+# Линии короче этого pdfplumber отбрасывает ещё до склейки соседних отрезков (edge_min_length_prefilter)
+TABLE_EDGE_MIN_LENGTH = 1
+# Уровень детализации описаний страниц: до этого размера страница уменьшается сразу после рендера
+PAGE_CAPTION_DETAIL = 'low'
+# Предел суммарного размера областей OCR (в пикселях), накопленных для одного пакета
+OCR_BATCH_PIXELS = int(os.environ.get('OCR_BATCH_PIXELS', 64 * 1024 * 1024))
+
+
+def may_have_tables(layout, min_length=TABLE_EDGE_MIN_LENGTH):
+    """
+    Быстрая проверка страницы перед page.extract_tables().
+    pdfplumber по умолчанию ищет таблицы по линиям разметки: ячейке нужны
+    хотя бы две горизонтальные и две вертикальные линии (LTLine, стороны
+    LTRect, отрезки LTCurve). Если на странице их меньше, extract_tables
+    гарантированно вернёт пустой список, и его можно не вызывать.
+    :param layout: LTPage страницы (pdfminer-разметка из PdfEngine)
+    :return: False, если таблиц на странице точно нет
+    """
+    horizontal = vertical = 0
+    stack = [layout]
+    while stack:
+        for element in stack.pop():
+            if isinstance(element, LTRect):
+                if element.width >= min_length:
+                    horizontal += 2
+                if element.height >= min_length:
+                    vertical += 2
+            elif isinstance(element, LTLine):
+                # Как и в pdfplumber, наклонная линия считается вертикальной
+                if element.y0 == element.y1:
+                    horizontal += element.width >= min_length
+                else:
+                    vertical += element.height >= min_length
+            elif isinstance(element, LTCurve):
+                for (x0, y0), (x1, y1) in zip(element.pts, element.pts[1:]):
+                    if x0 == x1:
+                        vertical += abs(y1 - y0) >= min_length
+                    elif y0 == y1:
+                        horizontal += abs(x1 - x0) >= min_length
+            elif isinstance(element, LTContainer) and not isinstance(element, LTTextContainer):
+                # Линии внутри форм (LTFigure) pdfplumber тоже учитывает
+                stack.append(element)
+            if horizontal >= 2 and vertical >= 2:
+                return True
+    return False
+
+
+class PdfEngine:
+    """
+    Открывает PDF один раз и раздаёт страницы всем этапам обработки.
+    Для каждой страницы отдаётся объект pdfplumber (таблицы) и его
+    pdfminer-разметка (текст, форматы, изображения), поэтому документ
+    больше не разбирается заново для каждой страницы.
+    """
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.pdf = None
+
+    def __enter__(self):
+        # laparams нужны, чтобы разметка совпадала с pdfminer.extract_pages
+        self.pdf = pdfplumber.open(self.pdf_path, laparams={})
+        return self
 
-    def text_extraction(self, element):
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pdf is not None:
+            self.pdf.close()
+            self.pdf = None
+
+    def __len__(self):
+        return len(self.pdf.pages)
+
+    def pages(self, first=0, last=None):
         """
-        Извлекает текст и форматы текста из элемента LTTextContainer.
+        Перебирает страницы документа.
+        :param first: Номер первой страницы (с нуля)
+        :param last: Номер страницы, на которой остановиться (не включая); None - до конца
+        :return: Генератор кортежей (номер страницы с нуля, страница pdfplumber, LTPage)
         """
-        line_text = element.get_text()
-        line_formats = []
+        for page_num, page in enumerate(self.pdf.pages[first:last], start=first):
+            try:
+                with metrics.span('pdf.layout', page=page_num + 1):
+                    layout = page.layout
+                yield page_num, page, layout
+            finally:
+                # Освобождаем кэш разобранной страницы, чтобы память не росла
+                page.close()
 
-        for text_line in element:
-            if isinstance(text_line, LTTextContainer):
-                for character in text_line:
-                    if isinstance(character, LTChar):
-                        line_formats.append((character.fontname, character.size))
 
-        format_per_line = list(set(line_formats))
-        return (line_text, format_per_line)
+class PdfRasterizer:
+    """
+    Пакетная растеризация страниц PDF в память.
+    Страницы собираются заранее, подряд идущие номера рендерятся одним
+    вызовом pdftoppm, который распределяется по потокам. Результат -
+    изображения PIL, без промежуточных PNG на диске.
+    """
 
-    def convert_page_to_image(self, pdf_path, page_num):
+    def __init__(self, pdf_path, dpi=200, thread_count=None, batch_size=16):
         """
-        Конвертирует страницу PDF в изображение.
-        ПРОСТОЙ И НАДЕЖНЫЙ МЕТОД.
+        :param pdf_path: Путь к PDF
+        :param dpi: Разрешение рендера
+        :param thread_count: Число потоков pdftoppm (по умолчанию - число ядер)
+        :param batch_size: Максимум страниц в одном вызове, ограничивает память
         """
-        try:
-            print(f"Конвертирую страницу {page_num + 1} в изображение...")
-            images = convert_from_path(pdf_path, first_page=page_num + 1, last_page=page_num + 1)
-
-            if images:
-                image_path = f"images/page_{page_num + 1}.png"
-                images[0].save(image_path, "PNG")
-                print(f"Изображение сохранено: {image_path}")
-                return image_path
-            else:
-                print(f"Не удалось конвертировать страницу {page_num + 1}")
-                return None
+        self.pdf_path = pdf_path
+        self.dpi = dpi
+        self.thread_count = thread_count or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
 
-        except Exception as e:
-            print(f"Ошибка при конвертации страницы {page_num + 1}: {e}")
-            return None
+    def _batches(self, page_nums):
+        """Разбивает номера страниц на отрезки подряд идущих страниц не длиннее batch_size."""
+        batch = []
+        for page_num in sorted(set(page_nums)):
+            if batch and (page_num != batch[-1] + 1 or len(batch) >= self.batch_size):
+                yield batch
+                batch = []
+            batch.append(page_num)
+        if batch:
+            yield batch
 
-    def image_to_text(self, image_path):
-        """Извлекает текст из изображения с помощью OCR."""
-        if not os.path.exists(image_path):
-            print(f"Файл {image_path} не найден")
-            return ""
+    def render(self, page_nums, dpi=None):
+        """
+        Рендерит указанные страницы.
+        :param page_nums: Номера страниц с нуля
+        :param dpi: Разрешение для этого вызова (по умолчанию self.dpi)
+        :return: Генератор пар (номер страницы, изображение PIL или None при ошибке)
+        """
+        for batch in self._batches(page_nums):
+            first, last = batch[0] + 1, batch[-1] + 1
+            print(f"Конвертирую страницы {first}-{last} в изображения...")
+            try:
+                with metrics.span('pdf.rasterize', pages=len(batch), dpi=dpi or self.dpi):
+                    images = convert_from_path(
+                        self.pdf_path,
+                        dpi=dpi or self.dpi,
+                        first_page=first,
+                        last_page=last,
+                        thread_count=min(self.thread_count, len(batch)),
+                    )
+                metrics.inc('pages_rasterized_total', len(images))
+            except Exception as e:
+                print(f"Ошибка при конвертации страниц {first}-{last}: {e}")
+                images = []
 
-        try:
-            img = Image.open(image_path)
-            text = pytesseract.image_to_string(img, lang='rus+eng')
-            return text.strip()
-        except Exception as e:
-            print(f"Ошибка OCR для {image_path}: {e}")
+            for i, page_num in enumerate(batch):
+                yield page_num, images[i] if i < len(images) else None
+
+
+class PdfExtraction:
+    def __init__(self):
+        """Инициализирует класс PdfExtraction. Страницы растеризуются в память, на диск ничего не пишется."""
+
+    def text_extraction(self, element, builder):
+        """
+        Извлекает текст и форматы текста из элемента LTTextContainer в PageBuilder.
+        Кортеж на каждый символ не создаётся: подряд идущие символы одного
+        шрифта передаются в PageBuilder одним отрезком.
+        """
+        run = []
+        fontname = size = None
+        for item in element:
+            if isinstance(item, LTChar):
+                if run and (item.fontname != fontname or item.size != size):
+                    builder.append(''.join(run), fontname, size)
+                    run = []
+                fontname, size = item.fontname, item.size
+                run.append(item.get_text())
+            elif isinstance(item, LTAnno):
+                run.append(item.get_text())
+            elif isinstance(item, LTTextContainer):
+                if run:
+                    builder.append(''.join(run), fontname, size)
+                    run = []
+                self.text_extraction(item, builder)
+        if run:
+            builder.append(''.join(run), fontname, size)
+
+    def image_to_text(self, image):
+        """
+        Извлекает текст из изображения с помощью OCR (через общий OcrEngine).
+        :param image: Путь к файлу, уже загруженное изображение PIL или байты файла
+        """
+        in_memory = isinstance(image, (Image.Image, bytes, bytearray))
+        if not in_memory and not os.path.exists(image):
+            print(f"Файл {image} не найден")
             return ""
+        return self.images_to_text([image])[0]
+
+    def images_to_text(self, images):
+        """
+        Распознаёт несколько изображений пакетно.
+        :return: Список строк в порядке images; для неудачных - пустая строка
+        """
+        texts = []
+        for i, result in enumerate(get_ocr_engine().recognize_many(images)):
+            if result.status != 'ok':
+                print(f"Ошибка OCR для изображения {i + 1}: {result.status} ({result.error})")
+            texts.append(result.text)
+        return texts
 
-    def extract_tables_from_page(self, pdf_path, page_num):
-        """Извлекает все таблицы с указанной страницы."""
+    @staticmethod
+    def crop_regions(image, plan):
+        """
+        Вырезает области плана OCR из растеризованной страницы.
+        Области переводятся в оттенки серого: для OCR цвет не нужен,
+        а памяти они занимают втрое меньше, чем RGB.
+        :return: Список изображений PIL, не зависящих от страницы
+        """
+        return [image.crop(box).convert('L') for box in plan.crop_boxes(image)]
+
+    def ocr_regions(self, pages):
+        """
+        Распознаёт области изображений по планам OCR, все области - одним пакетом.
+        Текст страницы - одна строка, как у image_to_text. Области закрываются после распознавания.
+        :param pages: Список пар (области страницы из crop_regions, OcrPlan)
+        :return: Список OcrResult в порядке pages; если какая-то область не
+                 распознана, статус страницы - статус этой области
+        """
+        crops = [(index, crop) for index, (page_crops, _) in enumerate(pages) for crop in page_crops]
+
+        results = get_ocr_engine().recognize_many([crop for _, crop in crops])
+        parts = [[plan.embedded_text] if plan.embedded_text else [] for _, plan in pages]
+        failures = [None] * len(pages)
+        for i, ((index, crop), result) in enumerate(zip(crops, results)):
+            crop.close()
+            if result.status != 'ok':
+                print(f"Ошибка OCR для изображения {i + 1}: {result.status} ({result.error})")
+                failures[index] = failures[index] or result
+            elif result.text:
+                parts[index].append(result.text)
+        page_results = []
+        for page_parts, failure in zip(parts, failures):
+            text = '\n\n'.join(page_parts)
+            page_results.append(OcrResult(text, failure.status, failure.error) if failure else OcrResult(text))
+        return page_results
+
+    def extract_tables_from_page(self, page, layout=None):
+        """
+        Извлекает все таблицы с уже открытой страницы pdfplumber.
+        :param layout: LTPage этой страницы; если передан, страницы без линий
+                       разметки пропускаются без вызова extract_tables (may_have_tables)
+        """
+        if layout is not None and not may_have_tables(layout):
+            metrics.inc('pdf_table_pages_total', result='skipped')
+            return []
+        metrics.inc('pdf_table_pages_total', result='checked')
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                if page_num < len(pdf.pages):
-                    page = pdf.pages[page_num]
-                    tables = page.extract_tables()
-                    return tables if tables else []
-                return []
+            with metrics.span('pdf.tables', page=page.page_number) as span:
+                tables = page.extract_tables()
+                span['tables'] = len(tables) if tables else 0
+            return tables if tables else []
         except Exception as e:
             print(f"Ошибка при извлечении таблиц: {e}")
             return []
@@ -84,96 +273,274 @@ class PdfExtraction:
         if not table:
             return ""
 
-        table_string = ''
-        for row in table:
-            cleaned_row = [
-                str(item).replace('\n', ' ') if item is not None else 'None'
-                for item in row
-            ]
-            table_string += '|' + '|'.join(cleaned_row) + '|\n'
-
-        return table_string.rstrip('\n')
+        # Строки собираются списком и склеиваются один раз
+        return '\n'.join(
+            '|' + '|'.join(str(item).replace('\n', ' ') if item is not None else 'None' for item in row) + '|'
+            for row in table
+        )
 
 
-def extract_pages_pdf(pdf_path):
+def extract_pages_pdf(pdf_path, dpi=200, thread_count=None, workers=1, shard_size=None):
     """
     ПРОСТАЯ И НАДЕЖНАЯ обработка PDF.
     Для каждой страницы:
     1. Извлекает текст
-    2. Если есть изображения (LTFigure) - конвертирует всю страницу
-    3. Извлекает таблицы
+    2. Если есть изображения (LTFigure) - OcrPlanner решает, нужен ли OCR:
+       страницы с текстовым слоем и мелкими изображениями его пропускают,
+       для остальных распознаются только области изображений из плана
+       (страница рендерится в разрешении плана, вырезаются области)
+    3. Описывает страницу с изображениями по уменьшенной копии рендера
+    4. Извлекает таблицы
+    Документ открывается и разбирается один раз (PdfEngine), разметка
+    и объект страницы используются всеми этапами. Страницы с изображениями
+    растеризуются в память (PdfRasterizer) окнами, см. _finish_window.
+    При workers > 1 диапазон страниц делится на отрезки, которые
+    обрабатываются в пуле процессов и собираются обратно по порядку страниц.
+    :param dpi: Разрешение растеризации страниц с изображениями
+    :param thread_count: Число потоков растеризации (в параллельном режиме - на процесс)
+    :param workers: Число процессов; 1 - последовательная обработка
+    :param shard_size: Число страниц в одном отрезке (по умолчанию подбирается по workers)
+    :return: Словарь {номер страницы: данные страницы}
+    """
+    return dict(iter_pages_pdf(pdf_path, dpi=dpi, thread_count=thread_count, workers=workers, shard_size=shard_size))
+
+
+def iter_pages_pdf(pdf_path, dpi=200, thread_count=None, workers=1, shard_size=None, window=16,
+                   first_window=None):
+    """
+    Потоковая обработка PDF: отдаёт страницы по мере готовности, по порядку.
+    В последовательном режиме страница без изображений отдаётся сразу после
+    разметки, если перед ней нет ждущих страниц с изображениями. Страницы
+    с изображениями копятся окном до window страниц (пакетная растеризация,
+    OCR, описания), и окно отдаётся сразу после обработки; первое окно -
+    first_window страниц, чтобы первые страницы появились быстро.
+    В параллельном режиме отрезки отдаются в порядке страниц по мере завершения.
+    :param window: Число страниц в окне последовательной обработки
+    :param first_window: Число страниц в первом окне (по умолчанию window)
+    :return: Генератор пар (номер страницы с единицы, данные страницы)
+    """
+    if not workers or workers <= 1:
+        yield from _iter_page_range(pdf_path, 0, None, dpi, thread_count, window, first_window)
+        return
+
+    page_count = pdf_page_count(pdf_path)
+    shards = _shard_ranges(page_count, workers, shard_size)
+    if len(shards) <= 1:
+        yield from _iter_page_range(pdf_path, 0, None, dpi, thread_count, window, first_window)
+        return
+
+    if thread_count is None:
+        # Делим ядра между процессами, чтобы pdftoppm не конкурировал за них
+        thread_count = max(1, (os.cpu_count() or 1) // workers)
+
+    print(f"Параллельная обработка: {page_count} страниц, {len(shards)} отрезков, {workers} процессов")
+    # Процессы пула не форкаются от вызывающего: в веб-приложении у него много потоков,
+    # и блокировка, захваченная другим потоком в момент fork (метрики, кэши), навсегда
+    # осталась бы захваченной в копии. forkserver запускает их от чистого процесса
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=_pool_context()) as pool:
+        futures = [
+            pool.submit(_extract_page_range, pdf_path, first, last, dpi, thread_count)
+            for first, last in shards
+        ]
+        # Отдаём в порядке отрезков, а не завершения - порядок страниц детерминирован
+        for future in futures:
+            pages, shard_metrics = future.result()
+            metrics.merge(shard_metrics)
+            yield from pages.items()
+
+
+def _pool_context():
+    """Контекст процессов пула: forkserver, где он есть, иначе spawn."""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def pdf_page_count(pdf_path):
+    """Возвращает число страниц PDF."""
+    with PdfEngine(pdf_path) as engine:
+        return len(engine)
+
+
+def _shard_ranges(page_count, workers, shard_size=None):
+    """
+    Делит страницы на непрерывные отрезки [first, last).
+    По умолчанию отрезков в несколько раз больше, чем процессов, чтобы
+    тяжёлые страницы не задерживали один процесс.
+    """
+    if shard_size is None:
+        shard_size = max(1, math.ceil(page_count / (workers * 4)))
+    return [
+        (first, min(first + shard_size, page_count))
+        for first in range(0, page_count, shard_size)
+    ]
+
+
+def _extract_page_range(pdf_path, first, last, dpi, thread_count):
+    """
+    Обрабатывает страницы [first, last) в процессе пула.
+    :return: Пара (данные страниц, метрики отрезка для Metrics.merge)
+    """
+    # Метрики процесса пула считаются заново для каждого отрезка (процесс обрабатывает несколько отрезков)
+    metrics.reset()
+    pages = dict(_iter_page_range(pdf_path, first, last, dpi, thread_count))
+    return pages, metrics.snapshot()
+
+
+def _iter_page_range(pdf_path, first, last, dpi, thread_count, window=16, first_window=None):
+    """
+    Обрабатывает страницы [first, last) окнами и отдаёт готовые страницы по порядку.
+    Страницы без изображений не ждут окна, пока перед ними нет страниц с изображениями.
     """
     extract = PdfExtraction()
-    all_pages_data = {}
-
-    for page_num, page in enumerate(extract_pages(pdf_path)):
-        print(f"\n=== Обработка страницы {page_num + 1} ===")
-
-        page_data = {
-            'text': '',
-            'images': [],
-            'tables': [],
-            'formats': []
-        }
-
-        # Флаг для отслеживания наличия изображений
-        has_images = False
-
-        # Обрабатываем элементы страницы
-        for element in page:
-            # Извлекаем текст
-            if isinstance(element, LTTextContainer):
-                line_text, formats = extract.text_extraction(element)
-                page_data['text'] += line_text
-                page_data['formats'].extend(formats)
-
-            # Проверяем наличие изображений
-            if isinstance(element, LTFigure):
-                has_images = True
-
-        # Если есть изображения - конвертируем всю страницу
-        if has_images:
-            print(f"Обнаружены изображения на странице {page_num + 1}")
-            image_path = extract.convert_page_to_image(pdf_path, page_num)
-
-            if image_path and os.path.exists(image_path):
-                print(f"Успешно создано изображение: {image_path}")
-
-                # OCR
-                ocr_text = extract.image_to_text(image_path)
-
-                # Описание изображения
-                try:
-                    image_extraction = ImageExtractions(image_path)
-                    description = image_extraction.gpt_describe()
-                except Exception as e:
-                    print(f"Ошибка при получении описания: {e}")
-                    description = "Описание недоступно"
-
-                page_data['images'].append({
-                    'path': image_path,
-                    'ocr_text': ocr_text,
-                    'description': description
-                })
-            else:
+    rasterizer = PdfRasterizer(pdf_path, dpi=dpi, thread_count=thread_count, batch_size=window)
+    planner = OcrPlanner()
+    # Одна таблица шрифтов на все страницы отрезка
+    fonts = FontTable()
+    pages_data = {}
+    figure_plans = {}
+    window_size = max(1, first_window or window)
+
+    with PdfEngine(pdf_path) as engine:
+        for page_num, plumber_page, page in engine.pages(first, last):
+            print(f"\n=== Обработка страницы {page_num + 1} ===")
+
+            builder = PageBuilder(fonts)
+
+            # Флаг для отслеживания наличия изображений
+            has_images = False
+
+            # Обрабатываем элементы страницы
+            for element in page:
+                # Извлекаем текст и отрезки шрифтов
+                if isinstance(element, LTTextContainer):
+                    extract.text_extraction(element, builder)
+
+                # Проверяем наличие изображений
+                if isinstance(element, LTFigure):
+                    has_images = True
+
+            # Страницы с изображениями растеризуются пакетом в конце окна;
+            # план определяет, нужен ли OCR и для каких областей
+            if has_images:
+                plan = planner.plan(page)
+                print(f"Обнаружены изображения на странице {page_num + 1}")
+                if plan.needs_ocr:
+                    print(f"OCR: {len(plan.regions)} областей, {plan.dpi} dpi")
+                else:
+                    print("OCR не требуется: текстовый слой есть, изображения мелкие")
+                figure_plans[page_num] = plan
+
+            page_data = builder.build()
+
+            # Извлекаем таблицы из уже открытой страницы
+            tables = extract.extract_tables_from_page(plumber_page, page)
+            for i, table in enumerate(tables):
+                table_string = extract.table_to_string(table)
+                if table_string:
+                    print(f"Найдена таблица {i + 1}:")
+                    print(table_string)
+                    page_data.tables.append({
+                        'number': i + 1,
+                        'data': table_string
+                    })
+
+            print(f"Страница {page_num + 1} обработана")
+            if not figure_plans:
+                # В окне нет страниц с изображениями - отдавать страницу можно сразу
+                yield page_num + 1, page_data
+                continue
+            pages_data[page_num + 1] = page_data
+
+            if len(pages_data) >= window_size:
+                yield from _finish_window(extract, rasterizer, pages_data, figure_plans)
+                pages_data = {}
+                figure_plans = {}
+                window_size = window
+
+    yield from _finish_window(extract, rasterizer, pages_data, figure_plans)
+
+
+def _caption_image(image):
+    """Уменьшенная копия страницы для описания (тот же размер, что получит модель)."""
+    size = target_size(image.size, PAGE_CAPTION_DETAIL)
+    if size == image.size:
+        return image.copy()
+    return image.resize(size, Image.Resampling.BICUBIC, reducing_gap=REDUCING_GAP)
+
+
+def _finish_window(extract, rasterizer, pages_data, figure_plans):
+    """
+    Растеризует страницы окна с изображениями, выполняет OCR нужных областей
+    и описание в памяти, затем отдаёт страницы окна по порядку.
+    Страницы без OCR рендерятся пакетно. Страницы с OCR рендерятся по одной
+    в разрешении плана: из страницы вырезаются только области плана, и она
+    сразу освобождается, а области распознаются пакетами не больше
+    OCR_BATCH_PIXELS. Для описания от каждой страницы остаётся уменьшенная копия.
+    Неудачные растеризация, OCR и описание записываются в errors страницы.
+    """
+    previews = {}     # номер страницы -> уменьшенная копия для описания
+    debug_paths = {}  # номер страницы -> путь отладочной копии (DEBUG_IMAGE_DIR)
+    ocr_results = {}  # номер страницы -> OcrResult
+
+    def render(page_nums, dpi):
+        for page_num, image in rasterizer.render(page_nums, dpi=dpi):
+            if image is None:
                 print(f"Не удалось создать изображение для страницы {page_num + 1}")
+                pages_data[page_num + 1].errors.append("не удалось растеризовать страницу")
+                continue
+            yield page_num, image
+
+    def release(page_num, image):
+        debug_paths[page_num] = save_debug_image(image, f"page_{page_num + 1}.png")
+        previews[page_num] = _caption_image(image)
+        image.close()
+
+    plain_pages = [page_num for page_num, plan in figure_plans.items() if not plan.needs_ocr]
+    for page_num, image in render(plain_pages, rasterizer.dpi):
+        release(page_num, image)
+        ocr_results[page_num] = OcrResult(figure_plans[page_num].embedded_text)
+
+    pending = []  # (номер страницы, области, OcrPlan) для следующего пакета OCR
+    pending_pixels = 0
+
+    def flush():
+        results = extract.ocr_regions([(crops, plan) for _, crops, plan in pending])
+        for (page_num, _, _), result in zip(pending, results):
+            ocr_results[page_num] = result
+        pending.clear()
+
+    for page_num in sorted(page_num for page_num, plan in figure_plans.items() if plan.needs_ocr):
+        plan = figure_plans[page_num]
+        for _, image in render([page_num], max(rasterizer.dpi, plan.dpi)):
+            crops = extract.crop_regions(image, plan)
+            release(page_num, image)
+            pixels = sum(crop.width * crop.height for crop in crops)
+            if pending and pending_pixels + pixels > OCR_BATCH_PIXELS:
+                flush()
+                pending_pixels = 0
+            pending.append((page_num, crops, plan))
+            pending_pixels += pixels
+    if pending:
+        flush()
+
+    # Описания страниц окна запрашиваются параллельно; страницы с одинаковым
+    # бланком похожи, поэтому описание из кэша берётся только для тех же пикселей
+    page_nums = sorted(previews)
+    captions = describe_images([previews[page_num] for page_num in page_nums],
+                               detail=PAGE_CAPTION_DETAIL, exact=True)
+    for page_num, caption in zip(page_nums, captions):
+        page_data = pages_data[page_num + 1]
+        ocr = ocr_results[page_num]
+        if ocr.status != 'ok':
+            page_data.errors.append(f"OCR: {ocr.status} ({ocr.error})")
+        if caption.status != 'ok':
+            page_data.errors.append(f"описание изображения: {caption.error}")
+        page_data.images.append({
+            # Путь есть только при отладочной записи на диск (DEBUG_IMAGE_DIR)
+            'path': debug_paths[page_num],
+            'ocr_text': ocr.text,
+            'description': caption.text
+        })
+        previews[page_num].close()
 
-        # Извлекаем таблицы
-        tables = extract.extract_tables_from_page(pdf_path, page_num)
-        for i, table in enumerate(tables):
-            table_string = extract.table_to_string(table)
-            if table_string:
-                print(f"Найдена таблица {i + 1}:")
-                print(table_string)
-                page_data['tables'].append({
-                    'number': i + 1,
-                    'data': table_string
-                })
-
-        # Убираем дубликаты форматов
-        page_data['formats'] = list(set(page_data['formats']))
-
-        all_pages_data[page_num + 1] = page_data
-        print(f"Страница {page_num + 1} обработана")
-
-    return all_pages_data
\ No newline at end of file
+    yield from sorted(pages_data.items())
@@ -0,0 +1,204 @@
+"""
+Пакетная обработка документов без интерфейса.
+
+Обходит директории и списки файлов, извлекает содержимое каждого
+поддерживаемого файла (MainModel_MainModule.content) в пуле процессов
+и дописывает результаты в JSONL: одна строка на файл со статусом
+(ok, partial - часть изображений не описана или не распознана, error -
+содержимое не получено), временем обработки, ошибками извлечения
+(errors) и исключением (exception), если они были. Каждая строка
+записывается сразу после обработки файла, поэтому после сбоя запуск
+с тем же --out продолжает с места остановки: успешно обработанные файлы
+(тот же путь, размер и время изменения) пропускаются, файлы с ошибками
+обрабатываются заново.
+
+Запуск:
+    python ingest.py /archive/2024 /archive/2025 --out results.jsonl --workers 8
+    python ingest.py --file-list files.txt --out results.jsonl
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from doc_extract.formats import get_format
+
+
+
+def discover_files(paths, file_list=None, recursive=True):
+    """
+    Собирает поддерживаемые файлы из путей и файла со списком путей.
+    :return: Список абсолютных путей без повторов, в порядке обхода
+    """
+    candidates = list(paths)
+    if file_list:
+        with open(file_list, encoding='utf-8') as f:
+            candidates.extend(line.strip() for line in f if line.strip())
+
+    seen = set()
+    files = []
+
+    def add(path):
+        path = os.path.abspath(path)
+        if path not in seen and get_format(path) is not None:
+            seen.add(path)
+            files.append(path)
+
+    for path in candidates:
+        if os.path.isdir(path):
+            if recursive:
+                for root, dirs, names in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(names):
+                        add(os.path.join(root, name))
+            else:
+                for name in sorted(os.listdir(path)):
+                    add(os.path.join(path, name))
+        elif os.path.isfile(path):
+            add(path)
+        else:
+            print(f"Путь не найден: {path}")
+    return files
+
+
+def file_signature(path):
+    """Путь, размер и время изменения - по ним уже обработанный файл узнаётся при повторном запуске."""
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def load_done(out_path):
+    """
+    Читает уже записанные результаты.
+    Оборванная при сбое последняя строка пропускается.
+    :return: Множество сигнатур успешно обработанных файлов
+    """
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok':
+                done.add((record['path'], record['size'], record['mtime_ns']))
+    return done
+
+
+def _to_json(value):
+    """Данные страниц (PageRecord) сериализуются как словари."""
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return str(value)
+
+
+def process_file(path):
+    """
+    Извлекает содержимое одного файла; выполняется в процессе пула.
+    :return: Запись результата (словарь для JSONL)
+    """
+    from model.model import MainModel_MainModule
+
+    _, size, mtime_ns = file_signature(path)
+    record = {'path': path, 'size': size, 'mtime_ns': mtime_ns}
+    work_dir = tempfile.mkdtemp(prefix='docanalyzer_ingest_')
+    start = time.perf_counter()
+    try:
+        processor = MainModel_MainModule(work_dir=work_dir)
+        # Параллельность - по файлам, внутри файла страницы обрабатываются последовательно
+        processor.pdf_workers = 1
+        processor.upload(path)
+        content = processor.content()
+        # Статус - по ошибкам, о которых сообщили экстракторы, а не по тексту результата
+        record['status'] = processor.extraction_status
+        if processor.extraction_status != 'error':
+            record['content'] = content
+        if processor.extraction_errors:
+            record['errors'] = processor.extraction_errors
+    except Exception as e:
+        record.update(status='error', exception=f"{type(e).__name__}: {e}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _init_worker():
+    # Вывод экстракторов из процессов пула не нужен: итог пишется в JSONL и в сводку
+    sys.stdout = open(os.devnull, 'w')
+
+
+def ingest(paths, out_path, workers=None, file_list=None, recursive=True, quiet_workers=True):
+    """
+    Обрабатывает файлы в пуле процессов и дописывает результаты в out_path.
+    :param paths: Директории и файлы
+    :param workers: Число процессов (по умолчанию - число ядер)
+    :param quiet_workers: Подавлять вывод экстракторов в процессах пула
+    :return: Словарь со статистикой запуска
+    """
+    workers = workers or os.cpu_count() or 1
+    files = discover_files(paths, file_list, recursive)
+    done = load_done(out_path)
+    pending = [path for path in files if file_signature(path) not in done]
+    print(f"Найдено файлов: {len(files)}, уже обработано: {len(files) - len(pending)}, "
+          f"к обработке: {len(pending)}, процессов: {workers}")
+
+    # Ядра уже заняты процессами по файлам - OCR внутри файла не распараллеливаем
+    os.environ.setdefault('OCR_WORKERS', '1')
+
+    stats = {'files': len(pending), 'ok': 0, 'partial': 0, 'error': 0, 'skipped': len(files) - len(pending)}
+    start = time.perf_counter()
+    if pending:
+        with open(out_path, 'a', encoding='utf-8') as out, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker if quiet_workers else None) as pool:
+            futures = {pool.submit(process_file, path): path for path in pending}
+            for count, future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # Процесс пула упал (например, нехватка памяти): ошибка записывается,
+                    # такие файлы будут обработаны заново при следующем запуске
+                    _, size, mtime_ns = file_signature(path)
+                    record = {'path': path, 'size': size, 'mtime_ns': mtime_ns,
+                              'status': 'error', 'exception': f"{type(e).__name__}: {e}", 'seconds': None}
+                out.write(json.dumps(record, ensure_ascii=False, default=_to_json) + '\n')
+                out.flush()
+                stats[record['status']] += 1
+                problems = record.get('errors', []) + ([record['exception']] if 'exception' in record else [])
+                print(f"[{count}/{len(pending)}] {record['status']} {record['seconds']} с {path}"
+                      + (f" - {'; '.join(problems)}" if problems else ''))
+
+    elapsed = time.perf_counter() - start
+    stats['seconds'] = round(elapsed, 2)
+    stats['files_per_second'] = round(len(pending) / elapsed, 2) if elapsed and pending else 0.0
+    print(f"Готово: {stats['ok']} успешно, {stats['partial']} частично, {stats['error']} с ошибками, "
+          f"{stats['skipped']} пропущено, {stats['seconds']} с ({stats['files_per_second']} файлов/с)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help='директории и файлы')
+    parser.add_argument('--file-list', help='файл со списком путей, по одному в строке')
+    parser.add_argument('--out', required=True, help='JSONL с результатами (дописывается)')
+    parser.add_argument('--workers', type=int, default=None, help='число процессов (по умолчанию - число ядер)')
+    parser.add_argument('--no-recursive', action='store_true', help='не обходить поддиректории')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод экстракторов')
+    args = parser.parse_args()
+
+    if not args.paths and not args.file_list:
+        parser.error('укажите директории/файлы или --file-list')
+
+    stats = ingest(args.paths, args.out, workers=args.workers, file_list=args.file_list,
+                   recursive=not args.no_recursive, quiet_workers=not args.verbose)
+    sys.exit(1 if stats['error'] or stats['partial'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,177 @@
 import gradio as gr
 import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from model.model import MainModel_MainModule
+from model.memory import ConversationMemory
+from model.prompt import serialize_content
+from doc_extract.metrics import metrics, start_metrics_server, DURATION_BUCKETS
+
+# Лимиты одновременных задач очереди Gradio: извлечение тяжёлое по CPU,
+# запросы к LLM в основном ждут сеть, поэтому их можно пускать больше
+EXTRACTION_CONCURRENCY = int(os.environ.get('EXTRACTION_CONCURRENCY', 2))
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', 16))
+QUEUE_MAX_SIZE = int(os.environ.get('QUEUE_MAX_SIZE', 100))
+
+
+def get_processor(session):
+    """Возвращает процессор сессии, создавая его со своей временной директорией при первом обращении"""
+    if session is None:
+        session = MainModel_MainModule(work_dir=tempfile.mkdtemp(prefix='docanalyzer_'))
+    return session
+
+
+def cleanup_session(session):
+    """
+    Удаляет временную директорию процессора сессии вместе с копией загруженного файла.
+    Вызывается при начале новой сессии и при закрытии вкладки (delete_callback состояния).
+    Файлы кэша загрузок Gradio не трогаются: одинаковые файлы разных сессий лежат
+    там по одному пути.
+    """
+    if session is None:
+        return
+    shutil.rmtree(session.work_dir, ignore_errors=True)
+    print("temp files was deleted")
+
+
+def copy_upload(processor, file_path):
+    """
+    Копирует загруженный файл в директорию сессии.
+    Gradio хранит загрузки по хэшу содержимого, поэтому один и тот же файл
+    двух сессий - это один путь; сессия работает только со своей копией.
+    :return: Путь к копии
+    """
+    upload_dir = os.path.join(processor.work_dir, 'upload')
+    # Предыдущая загрузка этой сессии больше не нужна
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    os.makedirs(upload_dir)
+    return shutil.copy(file_path, os.path.join(upload_dir, os.path.basename(file_path)))
 
-# Создаем экземпляр процессора (не меняем его методы)
-processor = MainModel_MainModule()
 
+# Число первых страниц, по которым запускается предварительный анализ
+PREVIEW_PAGES = 3
 
-# Обработчик загрузки файла
-def handle_upload(file_path):
+
+# Обработчик загрузки файла (потоковый: показывает прогресс по страницам).
+# Выполняется в группе "extraction" и занимает её слот только на время извлечения:
+# первый анализ запускается следующим шагом (handle_analysis) в группе "llm"
+def handle_upload(file_path, session):
+    processor = get_processor(session)
     if file_path is None or not os.path.exists(file_path):
-        return "Файл не загружен.", [], []
-    # Устанавливаем путь в процессоре
-    status = processor.upload(file_path)
-    # Получаем первичное содержимое (описание/текст)
-    content = processor.content()
-    # Формируем первый вопрос и ответ от AI
-    user_q = f"Вот считанный документ, что ты можешь про него рассказать? Документ: {content}"
-    bot_a = processor.doc_analyze_by_ai(user_q)
-    # История чата — список пар [вопрос, ответ]
-    history = [[user_q, bot_a]]
-    return status, history, history
+        yield "Файл не загружен.", [], [], None, processor, None
+        return
+    start = time.perf_counter()
+    # Устанавливаем в процессоре сессии путь к её собственной копии файла
+    status = processor.upload(copy_upload(processor, file_path))
+    total = processor.page_count()
+    history = []
+    memory = ConversationMemory()
+    yield f"{status}\nИзвлечение содержимого...", history, history, memory, processor, None
+
+    pages = {}
+    content = None
+    preview = None
+    # Предварительный анализ идёт в фоне; его не ждём - ответ забирает handle_analysis
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        # Получаем содержимое по мере готовности страниц
+        # Первое окно - PREVIEW_PAGES страниц, чтобы предварительный анализ начался сразу
+        for page_num, data in processor.iter_content(first_window=PREVIEW_PAGES):
+            if page_num is None:
+                content = data
+                break
+            pages[page_num] = data
+
+            # Предварительный анализ первых страниц, не дожидаясь конца извлечения
+            if preview is None and total and total > PREVIEW_PAGES and len(pages) >= PREVIEW_PAGES:
+                preview_q = (f"Вот первые страницы документа ({len(pages)} из {total}), "
+                             f"что ты можешь про них рассказать? Документ:\n{serialize_content(dict(pages))}")
+                preview = pool.submit(processor.doc_analyze_by_ai, preview_q)
+
+            if preview is not None and preview.done() and not history:
+                history = [["Предварительный анализ первых страниц", preview.result()]]
+
+            progress = f"{page_num} из {total}" if total else str(page_num)
+            yield f"{status}\nОбработано страниц: {progress}", history, history, memory, processor, None
+    finally:
+        pool.shutdown(wait=False)
+
+    if content is None:
+        content = pages
+    # Индекс для последующих вопросов: в них уходят только релевантные фрагменты
+    processor.build_index(content)
+    upload = {'status': status, 'content': content, 'preview': preview, 'start': start}
+    yield f"{status}\nИзвлечение завершено, идёт анализ...", history, history, memory, processor, upload
+
+
+# Первый анализ загруженного документа (группа "llm"): документ целиком или,
+# если он не помещается в контекст модели, пересказы его частей (map-reduce)
+def handle_analysis(upload, file_status, history, memory, session):
+    processor = get_processor(session)
+    if upload is None:
+        # Извлечение не состоялось - анализировать нечего
+        yield file_status, history, history, memory, processor, None
+        return
+    status = upload['status']
+    preview = upload['preview']
+    if preview is not None and not history:
+        history = [["Предварительный анализ первых страниц", preview.result()]]
+
+    # Формируем первый вопрос и показываем ответ AI по мере генерации
+    user_q = None
+    for event in processor.iter_first_analysis(upload['content']):
+        if event[0] == 'prompt':
+            user_q = event[1]
+        else:
+            _, stage, done, total = event
+            action = "Анализ частей документа" if stage == 'map' else "Объединение пересказов частей"
+            yield f"{status}\n{action}: {done} из {total}", history, history, memory, processor, None
+    # История чата — список пар [вопрос, ответ]; сам документ в историю не попадает
+    history = history + [[f"Загружен документ {status}. Что ты можешь про него рассказать?", ""]]
+    for token in processor.doc_analyze_by_ai_stream(user_q):
+        if not history[-1][1]:
+            # Время от загрузки до первого токена анализа - то, что видит пользователь
+            metrics.observe('upload_first_answer_seconds', time.perf_counter() - upload['start'],
+                            buckets=DURATION_BUCKETS)
+        history[-1][1] += token
+        yield f"{status}\nИдёт анализ...", history, history, memory, processor, None
+    # Память диалога с ограничением по токенам для последующих вопросов
+    for question, answer in history:
+        memory.add(question, answer, summarize=processor.summarize_dialog)
+    metrics.record_span('upload', time.perf_counter() - upload['start'], file=status)
+    yield status, history, history, memory, processor, None
 
 
 # Обработчик последующих сообщений
-def chat_interface(message, history):
+def chat_interface(message, history, memory, session):
+    processor = get_processor(session)
     # history — list of pairs
     if history is None:
         history = []
-    # Передаем последний пользовательский запрос
-    # Сохраняем новый запрос в историю для контекста
-    full_history = "".join([f"User: {h[0]}\nAssistant: {h[1]}\n" for h in history])
-    # Запрос к AI с учетом всей истории
+    # Память диалога: старые реплики свёрнуты в сводку, размер запроса ограничен
+    if memory is None:
+        memory = ConversationMemory()
+        for h in history:
+            memory.add(h[0], h[1], summarize=processor.summarize_dialog)
+    full_history = memory.render()
     question = message
-    answer = processor.doc_analyze_by_ai(f"История:\n{full_history}\nВопрос: {question}")
-    history.append([question, answer])
-    return history, history, ""
-
-
-def new_session():
-    # Удалим файл, если он существует
-    if processor.file_path and os.path.exists(processor.file_path):
-        try:
-            os.remove(processor.file_path)
-            print(f"Удалён файл: {processor.file_path}")
-        except Exception as e:
-            print(f"Ошибка при удалении файла: {e}")
-    processor.file_path = None  # Сброс пути к файлу
-    for file in os.listdir('images'):
-        path = os.path.join('images/', file)
-        os.remove(path)
-    print("temp files was deleted")
-    return None, [], [],  "", "Ожидается новый файл для анализа"
+    # Вместо всего документа - только фрагменты, найденные по вопросу
+    context = processor.retrieval_context(question)
+    prompt = f"Фрагменты документа:\n{context}\n\nИстория:\n{full_history}\nВопрос: {question}"
+    history.append([question, ""])
+    # Ответ показывается по мере генерации
+    for token in processor.doc_analyze_by_ai_stream(prompt):
+        history[-1][1] += token
+        yield history, history, "", memory, processor
+    memory.add(question, history[-1][1], summarize=processor.summarize_dialog)
+    yield history, history, "", memory, processor
+
 
+def new_session(session):
+    cleanup_session(session)
+    return None, [], [],  "", "Ожидается новый файл для анализа", None, None
 
 
 # Строим Gradio-интерфейс
@@ -69,28 +189,50 @@ with gr.Blocks(title="Документы с AI-анализом") as demo:
         with gr.Column(scale=4):
             chatbot = gr.Chatbot(label="GPT-Ассистент", height=750)
             state = gr.State([])
+            memory_state = gr.State(None)
+            # Процессор своей сессии: путь к файлу, индекс и временная директория.
+            # При закрытии вкладки файл и директория удаляются
+            session_state = gr.State(None, delete_callback=cleanup_session)
+            # Результат извлечения для первого анализа (передаётся из handle_upload в handle_analysis)
+            upload_state = gr.State(None)
             msg = gr.Textbox(label="Ваш вопрос", placeholder="Напишите запрос и нажмите Enter или кнопку ниже")
             send_btn = gr.Button("Отправить")
             new_session_btn = gr.Button("Начать новую сессию", variant="secondary")
 
     # Обработчики
+    # Извлечение и первый анализ - разные шаги: слоты извлечения не заняты ожиданием LLM
     upload_btn.click(fn=handle_upload,
-                     inputs=file_input,
-                     outputs=[file_status, chatbot, state])
+                     inputs=[file_input, session_state],
+                     outputs=[file_status, chatbot, state, memory_state, session_state, upload_state],
+                     concurrency_limit=EXTRACTION_CONCURRENCY,
+                     concurrency_id="extraction"
+                     ).then(fn=handle_analysis,
+                            inputs=[upload_state, file_status, state, memory_state, session_state],
+                            outputs=[file_status, chatbot, state, memory_state, session_state, upload_state],
+                            concurrency_limit=LLM_CONCURRENCY,
+                            concurrency_id="llm")
 
     send_btn.click(fn=chat_interface,
-                   inputs=[msg, state],
-                   outputs=[chatbot, state, msg])
+                   inputs=[msg, state, memory_state, session_state],
+                   outputs=[chatbot, state, msg, memory_state, session_state],
+                   concurrency_limit=LLM_CONCURRENCY,
+                   concurrency_id="llm")
 
     msg.submit(fn=chat_interface,
-               inputs=[msg, state],
-               outputs=[chatbot, state, msg])
+               inputs=[msg, state, memory_state, session_state],
+               outputs=[chatbot, state, msg, memory_state, session_state],
+               concurrency_limit=LLM_CONCURRENCY,
+               concurrency_id="llm")
 
     new_session_btn.click(
         fn=new_session,
-        inputs=[],
-        outputs=[file_input, chatbot, state, msg, file_status]
+        inputs=[session_state],
+        outputs=[file_input, chatbot, state, msg, file_status, memory_state, session_state]
     )
 
 if __name__ == "__main__":
-    demo.launch(share=False)
+    # Очередь нужна для потоковых (генераторных) обработчиков; лимиты
+    # задаются отдельно для извлечения и для запросов к LLM
+    # Метрики в формате Prometheus на отдельном порту (METRICS_PORT, 0 - выключить)
+    start_metrics_server()
+    demo.queue(max_size=QUEUE_MAX_SIZE).launch(share=False)
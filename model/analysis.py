@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from doc_extract.metrics import metrics
+from doc_extract.llm import get_llm_client
+from model.memory import estimate_tokens
+from model.prompt import page_sections, compact_text
+
+MAP_PROMPT = (
+    "Кратко перескажи эту часть документа: основные темы, факты, числа, имена, даты и выводы. "
+    "Сохраняй ссылки на страницы. Отвечай только пересказом.\n{text}"
+)
+REDUCE_PROMPT = (
+    "Объедини краткие содержания частей документа в одно, сохранив факты, числа, даты "
+    "и ссылки на страницы. Отвечай только объединённым содержанием.\n{text}"
+)
+
+
+def _pages_label(first, last):
+    if first is None:
+        return "Фрагмент"
+    return f"Страница {first}" if first == last else f"Страницы {first}-{last}"
+
+
+def _split_text(text, max_tokens):
+    """Делит слишком длинный текст на части по строкам так, чтобы каждая укладывалась в max_tokens."""
+    parts, current, size = [], [], 0
+    for line in text.split('\n'):
+        tokens = estimate_tokens(line) + 1
+        if current and size + tokens > max_tokens:
+            parts.append('\n'.join(current))
+            current, size = [], 0
+        current.append(line)
+        size += tokens
+    if current:
+        parts.append('\n'.join(current))
+    return parts
+
+
+def split_document(content, max_tokens):
+    """
+    Делит документ на части для отдельных запросов к модели.
+    Страницы PDF группируются подряд, пока часть укладывается в max_tokens;
+    страница больше лимита делится по строкам. Текст (DOCX) делится по строкам.
+    :param content: Словарь страниц PDF или текст
+    :return: Список словарей {'first': первая страница, 'last': последняя, 'text': текст}
+             (для текста номера страниц None)
+    """
+    if not isinstance(content, dict):
+        return [{'first': None, 'last': None, 'text': part}
+                for part in _split_text(compact_text(content), max_tokens) if part.strip()]
+
+    chunks = []
+    current, size = [], 0
+
+    def flush():
+        if current:
+            chunks.append({'first': current[0][0], 'last': current[-1][0],
+                           'text': '\n\n'.join(section for _, section in current)})
+
+    for page_num, section in page_sections(content):
+        tokens = estimate_tokens(section)
+        if tokens > max_tokens:
+            flush()
+            current, size = [], 0
+            for part in _split_text(section, max_tokens):
+                chunks.append({'first': page_num, 'last': page_num, 'text': part})
+            continue
+        if current and size + tokens > max_tokens:
+            flush()
+            current, size = [], 0
+        current.append((page_num, section))
+        size += tokens
+    flush()
+    return chunks
+
+
+class MapReduceAnalyzer:
+    """
+    Анализ документов, которые не помещаются в один запрос к модели.
+    Документ делится на части (split_document), части пересказываются
+    параллельно с ограничением числа одновременных запросов (map), затем
+    пересказы объединяются группами, уровень за уровнем, пока результат
+    не уложится в бюджет одного запроса (reduce). Пересказы частей
+    кэшируются по хэшу текста, модели и подсказки: повторная загрузка
+    документа не отправляет их заново, а последующие вопросы используют
+    пересказы частей, к которым относятся найденные фрагменты.
+    """
+
+    def __init__(self, cache=None, model="gpt-4.1-nano", chunk_tokens=None, context_tokens=None,
+                 max_concurrency=None, complete=None):
+        """
+        :param cache: ExtractionCache для пересказов частей, отдельный от кэша извлечения (None - без кэша)
+        :param chunk_tokens: Размер части в токенах (по умолчанию ANALYSIS_CHUNK_TOKENS или 6000)
+        :param context_tokens: Бюджет документа в одном запросе (по умолчанию ANALYSIS_CONTEXT_TOKENS или 24000)
+        :param max_concurrency: Одновременных запросов пересказа (по умолчанию ANALYSIS_CONCURRENCY или 4)
+        :param complete: Функция prompt -> ответ (по умолчанию общий клиент модели)
+        """
+        self.cache = cache
+        self.model = model
+        self.chunk_tokens = chunk_tokens or int(os.environ.get('ANALYSIS_CHUNK_TOKENS', 6000))
+        self.context_tokens = context_tokens or int(os.environ.get('ANALYSIS_CONTEXT_TOKENS', 24000))
+        self.max_concurrency = max(1, max_concurrency or int(os.environ.get('ANALYSIS_CONCURRENCY', 4)))
+        self.complete = complete or self._complete
+        # Пересказы частей последнего анализа: {'first', 'last', 'summary'}
+        self.summaries = []
+
+    def _complete(self, prompt):
+        return get_llm_client().complete([{"role": "user", "content": prompt}], model=self.model)
+
+    def fits(self, text):
+        """Проверяет, помещается ли текст в один запрос без map-reduce."""
+        return estimate_tokens(text) <= self.context_tokens
+
+    def _cache_key(self, prompt, text):
+        payload = json.dumps({'kind': 'summary', 'model': self.model, 'prompt': prompt, 'text': text},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _summarize(self, prompt, text):
+        """
+        Пересказывает текст, используя кэш.
+        :return: (пересказ, успешно ли)
+        """
+        key = self._cache_key(prompt, text) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if isinstance(cached, str):
+                return cached, True
+        try:
+            summary = self.complete(prompt.format(text=text))
+        except Exception as e:
+            print(f"Не удалось пересказать часть документа: {e}")
+            return f"(пересказ недоступен: {e})", False
+        if key is not None:
+            self.cache.put(key, summary)
+        return summary, True
+
+    def _run_stage(self, stage, prompt, items):
+        """
+        Пересказывает элементы параллельно.
+        :param items: Список словарей {'first', 'last', 'text'}
+        :return: Генератор событий ('progress', stage, готово, всего); результаты пишутся в item['summary']
+        """
+        with metrics.span('analysis.' + stage, parts=len(items)), \
+                ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items))) as pool:
+            futures = {pool.submit(self._summarize, prompt, item['text']): item for item in items}
+            for done, future in enumerate(as_completed(futures), start=1):
+                item = futures[future]
+                item['summary'], ok = future.result()
+                metrics.inc('analysis_parts_total', stage=stage, status='ok' if ok else 'error')
+                yield 'progress', stage, done, len(items)
+
+    def _group(self, items):
+        """Объединяет соседние пересказы в группы, каждая из которых укладывается в chunk_tokens."""
+        groups, current, size = [], [], 0
+        for item in items:
+            text = f"### {_pages_label(item['first'], item['last'])}\n{item['summary']}"
+            tokens = estimate_tokens(text)
+            if current and size + tokens > self.chunk_tokens:
+                groups.append(current)
+                current, size = [], 0
+            current.append((item, text))
+            size += tokens
+        if current:
+            groups.append(current)
+        return [{'first': group[0][0]['first'], 'last': group[-1][0]['last'],
+                 'text': '\n\n'.join(text for _, text in group)} for group in groups]
+
+    def iter_run(self, content):
+        """
+        Выполняет map-reduce по документу.
+        :return: Генератор событий ('progress', этап, готово, всего) и последнего
+                 ('notes', текст), где текст - пересказы с метками страниц для итогового запроса
+        """
+        chunks = split_document(content, self.chunk_tokens)
+        print(f"Документ разбит на {len(chunks)} частей для анализа")
+        yield from self._run_stage('map', MAP_PROMPT, chunks)
+        self.summaries = [{'first': c['first'], 'last': c['last'], 'summary': c['summary']} for c in chunks]
+
+        level = chunks
+        while sum(estimate_tokens(item['summary']) for item in level) > self.context_tokens:
+            groups = self._group(level)
+            if len(groups) == len(level):
+                # Каждый пересказ больше группы - объединять дальше нечего
+                break
+            yield from self._run_stage('reduce', REDUCE_PROMPT, groups)
+            level = groups
+
+        yield 'notes', '\n\n'.join(
+            f"### {_pages_label(item['first'], item['last'])}\n{item['summary']}" for item in level
+        )
+
+    def notes_for_pages(self, pages, limit=3):
+        """
+        Пересказы частей PDF, к которым относятся страницы (для последующих вопросов).
+        :param pages: Номера страниц найденных фрагментов
+        """
+        notes = []
+        for item in self.summaries:
+            if item['first'] is None:
+                # Части текста без страниц не сопоставить с фрагментами
+                continue
+            if any(page is not None and item['first'] <= page <= item['last'] for page in pages):
+                notes.append(f"### {_pages_label(item['first'], item['last'])}\n{item['summary']}")
+            if len(notes) >= limit:
+                break
+        return '\n\n'.join(notes)
@@ -0,0 +1,98 @@
+import os
+
+
+def estimate_tokens(text):
+    """
+    Быстрая локальная оценка числа токенов без токенизатора.
+    Латиница в среднем ~4 символа на токен, кириллица и прочие
+    не-ASCII символы ~3 (по длине в UTF-8 считаем их количество).
+    """
+    if not text:
+        return 0
+    chars = len(text)
+    non_ascii = min(chars, len(text.encode('utf-8')) - chars)
+    return int((chars - non_ascii) / 4 + non_ascii / 3) + 1
+
+
+def local_summary(summary, turns, max_chars=300):
+    """
+    Сводка без обращения к модели: к предыдущей сводке добавляются
+    вопросы и начала ответов. Используется, если модель недоступна.
+    """
+    parts = [summary] if summary else []
+    for question, answer in turns:
+        answer = ' '.join(answer.split())
+        if len(answer) > max_chars:
+            answer = answer[:max_chars].rsplit(' ', 1)[0] + '...'
+        parts.append(f"Пользователь спросил: {question}. Ответ: {answer}")
+    return '\n'.join(parts)
+
+
+class ConversationMemory:
+    """
+    Память диалога с ограничением по токенам.
+    Последние реплики хранятся дословно, а старые по мере превышения
+    бюджета сворачиваются в накопительную сводку. Размер истории в
+    запросе к модели не растёт с длиной сессии.
+    """
+
+    def __init__(self, token_budget=None, keep_recent=2):
+        """
+        :param token_budget: Бюджет токенов на историю (по умолчанию CHAT_MEMORY_TOKENS или 2000)
+        :param keep_recent: Сколько последних реплик по возможности оставлять дословно
+        """
+        self.token_budget = token_budget or int(os.environ.get('CHAT_MEMORY_TOKENS', 2000))
+        self.keep_recent = keep_recent
+        self.summary = ""
+        self.turns = []
+
+    def __len__(self):
+        return len(self.turns)
+
+    def tokens(self):
+        """Оценка числа токенов, которое память занимает в запросе."""
+        return estimate_tokens(self.summary) + sum(
+            estimate_tokens(question) + estimate_tokens(answer) for question, answer in self.turns
+        )
+
+    def add(self, question, answer, summarize=None):
+        """
+        Добавляет реплику и при превышении бюджета сворачивает старые.
+        :param summarize: Функция (сводка, реплики) -> новая сводка; по умолчанию local_summary
+        """
+        self.turns.append((question, answer))
+        self.compact(summarize)
+
+    def compact(self, summarize=None):
+        """Сворачивает старые реплики в сводку, пока память не уложится в бюджет."""
+        if self.tokens() <= self.token_budget:
+            return
+
+        # Всё, кроме последних keep_recent реплик, сворачиваем одним запросом
+        fold = len(self.turns) - self.keep_recent
+        if fold > 0:
+            folded, self.turns = self.turns[:fold], self.turns[fold:]
+            new_summary = summarize(self.summary, folded) if summarize else None
+            self.summary = new_summary or local_summary(self.summary, folded)
+
+        # Если последние реплики сами не влезают, дословно оставляем только самую свежую
+        while len(self.turns) > 1 and self.tokens() > self.token_budget:
+            self.summary = local_summary(self.summary, self.turns[:1])
+            self.turns = self.turns[1:]
+
+        # Сводка занимает не больше половины бюджета, последняя реплика - остаток
+        half_chars = self.token_budget * 3 // 2
+        if estimate_tokens(self.summary) > self.token_budget // 2:
+            self.summary = '...' + self.summary[-half_chars:]
+        if self.turns and self.tokens() > self.token_budget:
+            question, answer = self.turns[-1]
+            self.turns[-1] = (question[:half_chars], answer[:half_chars] + '...')
+
+    def render(self):
+        """Возвращает историю для подстановки в запрос к модели."""
+        parts = []
+        if self.summary:
+            parts.append(f"Краткое содержание предыдущего диалога:\n{self.summary}\n")
+        for question, answer in self.turns:
+            parts.append(f"User: {question}\nAssistant: {answer}\n")
+        return ''.join(parts)
@@ -1,38 +1,49 @@
 import sys
 sys.stdin.reconfigure(encoding='utf-8')
 
-import gradio as gr
 import os
-from g4f.client import Client
-from g4f import Provider
-import g4f
-from collections import deque
-import tkinter as tk
-from tkinter import filedialog
-from doc_extract.images_descriptions import ImageExtractions
-# Импорты для обработки документов
-try:
-    from doc_extract.pdf import extract_pages_pdf
-
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-    print("Модуль для обработки PDF недоступен")
-
-try:
-    from doc_extract.docx import DocxExtracting
-
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
-    print("Модуль для обработки DOCX недоступен")
+import time
+from doc_extract.cache import ExtractionCache
+from doc_extract.formats import get_format, supported_extensions
+from model.memory import ConversationMemory, local_summary, estimate_tokens
+from model.prompt import serialize_content
+from model.analysis import MapReduceAnalyzer
+from doc_extract.metrics import metrics, DURATION_BUCKETS
+from doc_extract.llm import get_llm_client
+# Экстракторы (pdfplumber, pdf2image, Tesseract, PIL) и интерфейсные библиотеки
+# импортируются при первом использовании: см. doc_extract.formats
 
 
 class MainModel_MainModule:
-    def __init__(self):
+    def __init__(self, work_dir='images'):
+        """
+        :param work_dir: Директория временных файлов (изображения из DOCX).
+                         В веб-приложении у каждой сессии своя директория.
+        """
         self.file_path = None
-        self.supported_image_formats = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp']
-        self.supported_document_formats = ['.pdf', '.docx']
+        self.work_dir = work_dir
+        self.supported_image_formats = supported_extensions('image')
+        self.supported_document_formats = supported_extensions('pdf') + supported_extensions('docx')
+        # Число процессов для обработки PDF (1 - последовательно)
+        self.pdf_workers = int(os.environ.get('PDF_WORKERS', 1))
+        # DOCX_OCR=1 включает распознавание текста на изображениях DOCX
+        self.docx_ocr = os.environ.get('DOCX_OCR', '0') == '1'
+        # Кэш результатов извлечения; EXTRACTION_CACHE=0 отключает его
+        self.cache = ExtractionCache() if os.environ.get('EXTRACTION_CACHE', '1') != '0' else None
+        # Пересказы частей больших документов - в своей директории и со своими метриками
+        self.summary_cache = ExtractionCache(
+            cache_dir=os.environ.get('SUMMARY_CACHE_DIR', os.path.join('.cache', 'summaries')),
+            max_bytes=64 * 1024 * 1024,
+            name='summary',
+        ) if self.cache is not None else None
+        # Поисковый индекс по текущему документу, строится при загрузке
+        self.index = None
+        # Пересказы частей большого документа после первого анализа (map-reduce)
+        self.analyzer = None
+        # Итог последнего извлечения: 'ok', 'partial' (часть изображений не описана
+        # или не распознана) или 'error' (содержимое не получено), и причины ошибок
+        self.extraction_status = None
+        self.extraction_errors = []
 
     def is_image_file(self, file_path):
         """Проверяет, является ли файл изображением"""
@@ -43,44 +54,214 @@ class MainModel_MainModule:
         return os.path.splitext(file_path)[1].lower() in self.supported_document_formats
 
     def content(self):
-        """Обрабатывает содержимое файла в зависимости от его типа"""
+        """
+        Обрабатывает содержимое файла, повторно загруженные файлы берутся из кэша.
+        Итог извлечения - в extraction_status и extraction_errors.
+        """
+        self._reset_extraction()
         if not self.file_path:
-            return "Файл не выбран"
+            return self._fail("Файл не выбран")
 
         file_ext = os.path.splitext(self.file_path)[1].lower()
+        with metrics.span('extract', format=file_ext):
+            if self.cache is None or not (self.is_image_file(self.file_path) or self.is_document_file(self.file_path)):
+                return self._extract_content()
+
+            return self.cache.get_or_compute(
+                self.file_path,
+                self._extract_content,
+                settings=self._cache_settings(),
+                should_store=self._is_cacheable,
+            )
 
-        # Обработка изображений
+    def _cache_settings(self):
+        """Настройки, от которых зависит результат извлечения (входят в ключ кэша)"""
+        return {'format': os.path.splitext(self.file_path)[1].lower(), 'docx_ocr': self.docx_ocr}
+
+    def iter_content(self, window=16, first_window=None):
+        """
+        Потоковая обработка файла.
+        Для PDF отдаёт пары (номер страницы, данные страницы) по мере готовности,
+        для остальных файлов - одну пару (None, результат content()).
+        :param window: Число страниц PDF в окне обработки изображений (см. iter_pages_pdf)
+        :param first_window: Число страниц в первом окне - чтобы первые страницы пришли быстрее
+        Ошибка обработки PDF отдаётся парой (None, текст ошибки).
+        Итог извлечения - в extraction_status и extraction_errors, как у content().
+        """
+        backend = get_format(self.file_path) if self.file_path else None
+        if backend is None or backend.kind != 'pdf' or not backend.available():
+            yield None, self.content()
+            return
+
+        self._reset_extraction()
+
+        key = None
+        if self.cache is not None:
+            try:
+                key = self.cache.make_key(self.file_path, self._cache_settings())
+            except OSError as e:
+                print(f"Кэш недоступен для {self.file_path}: {e}")
+            cached = self.cache.get(key) if key else None
+            if isinstance(cached, dict):
+                print("Результат извлечения взят из кэша")
+                yield from cached.items()
+                return
+
+        print("Обнаружен PDF документ, начинаю обработку...")
+        pages = {}
+        start = time.perf_counter()
+        try:
+            for page_num, page_data in backend.load().iter_pages_pdf(self.file_path, workers=self.pdf_workers,
+                                                                     window=window, first_window=first_window):
+                pages[page_num] = page_data
+                yield page_num, page_data
+        except Exception as e:
+            metrics.record_span('extract', time.perf_counter() - start, status='error', format='.pdf')
+            yield None, self._fail(f"Ошибка при обработке PDF: {str(e)}")
+            return
+        # Полное время потоковой обработки, включая ожидание потребителя страниц
+        metrics.record_span('extract', time.perf_counter() - start, format='.pdf', pages=len(pages))
+
+        self._add_page_errors(pages)
+        if key is not None and self._is_cacheable(pages):
+            self.cache.put(key, pages)
+
+    def clear_temp_files(self):
+        """Удаляет временные файлы из рабочей директории процессора"""
+        if os.path.exists(self.work_dir):
+            try:
+                for filename in os.listdir(self.work_dir):
+                    file_path = os.path.join(self.work_dir, filename)
+                    if os.path.isfile(file_path):
+                        os.remove(file_path)
+                print("Временные файлы очищены.")
+            except Exception as e:
+                print(f"Ошибка при очистке временных файлов: {e}")
+
+    def build_index(self, content):
+        """Строит поисковый индекс по извлечённому содержимому документа"""
+        from model.retrieval import DocumentIndex
+
+        self.index = DocumentIndex.from_content(content)
+        print(f"Поисковый индекс построен: {len(self.index)} фрагментов")
+        return self.index
+
+    def retrieval_context(self, question, top_k=5):
+        """Возвращает фрагменты документа, относящиеся к вопросу, со ссылками на страницы"""
+        if self.index is None:
+            return ""
+        context = self.index.build_context(question, top_k)
+        if self.analyzer is not None and self.analyzer.summaries:
+            # Пересказы частей, к которым относятся найденные фрагменты, уже получены при загрузке
+            pages = [chunk['page'] for _, chunk in self.index.search(question, top_k)]
+            notes = self.analyzer.notes_for_pages(pages)
+            if notes:
+                context = f"Краткое содержание соответствующих частей:\n{notes}\n\n{context}"
+        return context
+
+    def iter_first_analysis(self, content):
+        """
+        Готовит первый запрос анализа документа.
+        Документ, который помещается в ANALYSIS_CONTEXT_TOKENS, уходит в запрос целиком,
+        больший сначала пересказывается по частям (MapReduceAnalyzer).
+        :return: Генератор событий ('progress', этап, готово, всего) и последнего ('prompt', текст запроса)
+        """
+        # Документ уходит в запрос компактным markdown с метками страниц, а не repr словаря
+        document = serialize_content(content)
+        self.analyzer = MapReduceAnalyzer(cache=self.summary_cache)
         if self.is_image_file(self.file_path):
+            yield 'prompt', f"Вот описание изображения, проанализируй его: {document}"
+            return
+        if self.analyzer.fits(document):
+            yield 'prompt', f"Вот считанный документ, что ты можешь про него рассказать? Документ:\n{document}"
+            return
+
+        for event in self.analyzer.iter_run(content):
+            if event[0] == 'notes':
+                yield 'prompt', ("Документ большой, поэтому он пересказан по частям. Вот пересказы его частей "
+                                 f"с номерами страниц, что ты можешь про документ рассказать?\n{event[1]}")
+            else:
+                yield event
+
+    def page_count(self):
+        """Возвращает число страниц PDF или None для остальных файлов"""
+        backend = get_format(self.file_path) if self.file_path else None
+        if backend is None or backend.kind != 'pdf' or not backend.available():
+            return None
+        try:
+            return backend.load().pdf_page_count(self.file_path)
+        except Exception as e:
+            print(f"Не удалось определить число страниц: {e}")
+            return None
+
+    def _reset_extraction(self):
+        self.extraction_status = 'ok'
+        self.extraction_errors = []
+
+    def _fail(self, message, error=None):
+        """Отмечает, что содержимое не получено. :return: Сообщение для пользователя"""
+        self.extraction_status = 'error'
+        self.extraction_errors.append(error or message)
+        return message
+
+    def _add_errors(self, errors):
+        """Отмечает частичные ошибки (описание, OCR изображений) - содержимое при этом есть."""
+        if errors:
+            self.extraction_errors.extend(errors)
+            if self.extraction_status == 'ok':
+                self.extraction_status = 'partial'
+
+    def _add_page_errors(self, pages):
+        self._add_errors([f"страница {page_num}: {error}"
+                          for page_num, page_data in pages.items() for error in page_data.errors])
+
+    def _is_cacheable(self, result):
+        """Кэшируется только результат извлечения без ошибок (extraction_status == 'ok')"""
+        return self.extraction_status == 'ok'
+
+    def _extract_content(self):
+        """Обрабатывает содержимое файла в зависимости от его типа"""
+        file_ext = os.path.splitext(self.file_path)[1].lower()
+        backend = get_format(self.file_path)
+
+        # Обработка изображений
+        if backend is not None and backend.kind == 'image':
             print("Обнаружено изображение, начинаю обработку...")
-            image_processor = ImageExtractions(self.file_path)
-            return image_processor.gpt_describe()
+            image_processor = backend.load().ImageExtractions(self.file_path)
+            description = image_processor.gpt_describe()
+            if image_processor.error is not None:
+                return self._fail(description, image_processor.error)
+            return description
 
         # Обработка документов
-        elif file_ext == '.pdf':
+        elif backend is not None and backend.kind == 'pdf':
             print("Обнаружен PDF документ, начинаю обработку...")
-            if PDF_AVAILABLE:
+            if backend.available():
                 try:
-                    return extract_pages_pdf(self.file_path)
+                    pages = backend.load().extract_pages_pdf(self.file_path, workers=self.pdf_workers)
                 except Exception as e:
-                    return f"Ошибка при обработке PDF: {str(e)}"
+                    return self._fail(f"Ошибка при обработке PDF: {str(e)}")
+                self._add_page_errors(pages)
+                return pages
             else:
-                return "Обработка PDF недоступна (модуль doc_extract.pdf не найден)"
+                return self._fail("Обработка PDF недоступна (модуль doc_extract.pdf не найден)")
 
-        elif file_ext == '.docx':
+        elif backend is not None and backend.kind == 'docx':
             print("Обнаружен DOCX документ, начинаю обработку...")
-            if DOCX_AVAILABLE:
+            if backend.available():
                 try:
-                    docx = DocxExtracting(self.file_path)
-                    return docx.make_description()
+                    docx = backend.load().DocxExtracting(self.file_path, image_dir=self.work_dir,
+                                                         ocr_images=self.docx_ocr)
+                    description = docx.make_description()
                 except Exception as e:
-                    return f"Ошибка при обработке DOCX: {str(e)}"
+                    return self._fail(f"Ошибка при обработке DOCX: {str(e)}")
+                self._add_errors(docx.errors)
+                return description
             else:
-                return "Обработка DOCX недоступна (модуль doc_extract.docx не найден)"
+                return self._fail("Обработка DOCX недоступна (модуль doc_extract.docx не найден)")
 
         else:
-            return f"Неподдерживаемый формат файла: {file_ext}"
-
-    file_input = gr.File(type="filepath")
+            return self._fail(f"Неподдерживаемый формат файла: {file_ext}")
 
     def upload(self, path: str):
         self.file_path = path
@@ -88,6 +269,10 @@ class MainModel_MainModule:
 
     def choose_file(self):
         """Открывает диалоговое окно для выбора файла"""
+        # tkinter нужен только консольному режиму, в веб-приложении и пакетной обработке не загружается
+        import tkinter as tk
+        from tkinter import filedialog
+
         root = tk.Tk()
         root.withdraw()  # Скрываем главное окно Tkinter
 
@@ -117,20 +302,63 @@ class MainModel_MainModule:
 
         root.destroy()
 
+    @staticmethod
+    def _observe_prompt(question):
+        """Учитывает размер запроса к модели в метриках."""
+        metrics.observe('prompt_chars', len(question), kind='chat')
+        metrics.observe('prompt_tokens', estimate_tokens(question), kind='chat')
+
     def doc_analyze_by_ai(self, question, search=False):
         """Анализирует документ с помощью AI"""
-        client = Client()
+        self._observe_prompt(question)
         try:
-            response = client.chat.completions.create(
-                model="gpt-4.1-nano",  # Изменена модель для лучшей поддержки
-                messages=[{"role": "user", "content": question}],
-                web_search=search,
-
-            )
-            return response.choices[0].message.content
+            with metrics.span('llm.request', stream=False):
+                return get_llm_client().complete(
+                    [{"role": "user", "content": question}],
+                    model="gpt-4.1-nano",  # Изменена модель для лучшей поддержки
+                    web_search=search,
+                )
         except Exception as e:
             return f"Ошибка при обращении к API: {str(e)}"
 
+    def doc_analyze_by_ai_stream(self, question, search=False):
+        """
+        Анализирует документ с помощью AI, отдавая ответ по частям по мере генерации.
+        :return: Генератор фрагментов текста ответа
+        """
+        self._observe_prompt(question)
+        start = time.perf_counter()
+        first_token = True
+        try:
+            with metrics.span('llm.request', stream=True):
+                for token in get_llm_client().stream(
+                        [{"role": "user", "content": question}],
+                        model="gpt-4.1-nano",
+                        web_search=search,
+                ):
+                    if first_token:
+                        metrics.observe('llm_first_token_seconds', time.perf_counter() - start,
+                                        buckets=DURATION_BUCKETS)
+                        first_token = False
+                    yield token
+        except Exception as e:
+            yield f"Ошибка при обращении к API: {str(e)}"
+
+    def summarize_dialog(self, summary, turns):
+        """
+        Дополняет сводку диалога старыми репликами с помощью AI.
+        При ошибке API возвращается локальная сводка.
+        """
+        dialog = "".join(f"User: {question}\nAssistant: {answer}\n" for question, answer in turns)
+        result = self.doc_analyze_by_ai(
+            "Обнови краткое содержание диалога, сохранив факты, числа и договорённости. "
+            "Ответь только новым кратким содержанием.\n"
+            f"Текущее краткое содержание:\n{summary or '(пусто)'}\n\nНовые реплики:\n{dialog}"
+        )
+        if not result or result.startswith("Ошибка при обращении к API"):
+            return local_summary(summary, turns)
+        return result
+
     def interface(self):
         """Основной интерфейс программы"""
         print("=== Анализатор документов и изображений ===")
@@ -148,20 +376,30 @@ class MainModel_MainModule:
         # Получаем содержимое файла
         content = self.content()
 
-        if "Ошибка" in content or "недоступна" in content:
+        if self.extraction_status == 'error':
             print(f"Проблема с обработкой файла: {content}")
             return
+        if self.extraction_errors:
+            print(f"Часть изображений не обработана: {'; '.join(self.extraction_errors)}")
+
+        # Поисковый индекс: в последующие вопросы уходят только релевантные фрагменты
+        self.build_index(content)
+
+        # Первый запрос: документ целиком или, если он слишком большой, пересказы его частей
+        for event in self.iter_first_analysis(content):
+            if event[0] == 'prompt':
+                first_question = event[1]
+            else:
+                _, stage, done, total = event
+                print(f"{'Анализ частей документа' if stage == 'map' else 'Объединение пересказов'}: {done} из {total}")
 
         session = True
-        history_dialog = ""
+        memory = ConversationMemory()
         cont = 0
 
         while session:
             if cont == 0:
-                if self.is_image_file(self.file_path):
-                    question = f"Вот описание изображения, проанализируй его: {content}"
-                else:
-                    question = f"Вот считанный для тебя документ, что ты можешь про него рассказать? Документ: {content}"
+                question = first_question
             else:
                 print('\nЧто хотите спросить? (введите "exit" для выхода)')
                 question = str(input('Вводите: ')).encode('utf-8').decode('utf-8', errors='ignore')
@@ -172,32 +410,25 @@ class MainModel_MainModule:
 
                 if question.lower() in ["exit", "quit", "выйти"]:
                     session = False
-                    # Очистка папки images если она существует
-                    if os.path.exists('images'):
-                        try:
-                            for filename in os.listdir('images'):
-                                file_path = os.path.join('images', filename)
-                                if os.path.isfile(file_path):
-                                    os.remove(file_path)
-                            print("Временные файлы очищены.")
-                        except Exception as e:
-                            print(f"Ошибка при очистке временных файлов: {e}")
+                    self.clear_temp_files()
                     break
 
 
-            # Формируем полный вопрос с историей
-            if len(history_dialog) > 1:
-                full_question = f"История вашей переписки: {history_dialog}, Вопрос пользователя: {question}"
+            # Формируем полный вопрос с историей и фрагментами документа
+            if len(memory) > 0 or memory.summary:
+                context = self.retrieval_context(question)
+                full_question = (f"Фрагменты документа: {context}\n"
+                                 f"История вашей переписки: {memory.render()}, Вопрос пользователя: {question}")
             else:
                 full_question = question
 
             # Получаем ответ от AI
             answer = self.doc_analyze_by_ai(full_question)
 
-            # Сохраняем ответ в историю
-            history_dialog += f"User question{cont+1}: {question}\nYour answer{cont+1}: {answer}"
-            if cont > 4:
-                history_dialog.pop(0)
+            # Сохраняем ответ в историю (сам документ в историю не попадает)
+            asked = "Анализ загруженного документа" if cont == 0 else question
+            # Старые реплики сворачиваются в сводку при превышении бюджета токенов
+            memory.add(asked, answer, summarize=self.summarize_dialog)
 
             print(f"\nОтвет {cont + 1}: {answer}")
             print('*' * 80)
@@ -0,0 +1,177 @@
+import re
+from collections import Counter
+from doc_extract.metrics import metrics
+from model.memory import estimate_tokens
+
+_SPACES_RE = re.compile(r'[ \t\u00a0]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+_DIGITS_RE = re.compile(r'\d+')
+# Номер страницы после замены цифр на '#': «3», «- 3 -», «Стр. 3 из 40», «Page 3/40»
+_PAGE_NUMBER_RE = re.compile(r'^\W*(стр\.?|страница|page)?\s*#+(\s*(из|/|of)\s*#+)?\W*$', re.IGNORECASE)
+
+# Сколько первых и последних строк страницы проверяется на колонтитулы
+EDGE_LINES = 2
+# Строка считается колонтитулом, если повторяется на такой доле страниц (и не меньше чем на 3)
+REPEATED_SHARE = 0.5
+
+
+def compact_text(text):
+    """
+    Сжимает текст для запроса к модели: повторные пробелы схлопываются,
+    пробелы по краям строк убираются, подряд идущие пустые строки
+    сводятся к одной.
+    """
+    if not text:
+        return ''
+    lines = [_SPACES_RE.sub(' ', line).strip() for line in str(text).splitlines()]
+    return _BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def rows_markdown(rows):
+    """
+    Переводит строки таблицы (списки ячеек, первая строка - заголовок) в короткую
+    таблицу markdown: пробелы и переносы внутри ячеек схлопываются, '|' в тексте
+    заменяется на '/', пустые ряды и пустые столбцы справа отбрасываются,
+    разделитель заголовка без лишних пробелов. Используется для таблиц PDF и DOCX.
+    """
+    rows = [[' '.join(str(cell).replace('|', '/').split()) for cell in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if not rows:
+        return ''
+
+    width = max(len(row) for row in rows)
+    while width > 1 and not any(len(row) >= width and row[width - 1] for row in rows):
+        width -= 1
+    lines = ['|' + '|'.join(row[:width] + [''] * (width - len(row))) + '|' for row in rows]
+    lines.insert(1, '|' + '|'.join(['-'] * width) + '|')
+    return '\n'.join(lines)
+
+
+def table_markdown(data):
+    """
+    Переводит таблицу PDF ('|a|b|' по строке на ряд, пустые ячейки - 'None')
+    в короткую таблицу markdown (см. rows_markdown).
+    """
+    rows = []
+    for line in data.splitlines():
+        line = line.strip()
+        if line.startswith('|') and line.endswith('|') and len(line) > 1:
+            line = line[1:-1]
+        rows.append(['' if cell.strip() == 'None' else cell for cell in line.split('|')])
+    return rows_markdown(rows)
+
+
+def _edge_lines(lines):
+    """Номера первых и последних строк страницы, где обычно стоят колонтитулы."""
+    return set(range(min(EDGE_LINES, len(lines)))) | set(range(max(0, len(lines) - EDGE_LINES), len(lines)))
+
+
+def _boilerplate_key(line):
+    """
+    Ключ сравнения строки колонтитула.
+    Цифры не учитываются только в номерах страниц («Стр. 3 из 40»), остальные
+    строки должны повторяться дословно: «Счёт № 12» и «Счёт № 13» - разные строки.
+    """
+    normalized = _DIGITS_RE.sub('#', line)
+    return normalized if _PAGE_NUMBER_RE.match(normalized) else line
+
+
+def repeated_lines(pages_lines):
+    """
+    Находит колонтитулы: строки у края страницы, повторяющиеся на многих страницах.
+    :param pages_lines: Списки строк страниц
+    :return: Множество ключей строк-колонтитулов (_boilerplate_key)
+    """
+    if len(pages_lines) < 3:
+        return set()
+    counts = Counter()
+    for lines in pages_lines:
+        counts.update({_boilerplate_key(lines[i]) for i in _edge_lines(lines) if lines[i]})
+    threshold = max(3, REPEATED_SHARE * len(pages_lines))
+    return {line for line, count in counts.items() if count >= threshold}
+
+
+def serialize_pages(pages):
+    """Представляет страницы PDF markdown-текстом с метками страниц (см. page_sections)."""
+    return '\n\n'.join(section for _, section in page_sections(pages))
+
+
+def page_sections(pages):
+    """
+    Переводит страницы PDF в markdown, по разделу на страницу.
+    В запрос попадают текст, таблицы, описания и распознанный текст
+    изображений; шрифты и пути к файлам отбрасываются. Колонтитулы
+    оставляются только на первой странице, где они встретились (страница
+    из одних колонтитулов остаётся целиком), текст OCR - только если его
+    нет в тексте страницы.
+    :param pages: Словарь {номер страницы: данные страницы}
+    :return: Список пар (номер страницы, текст раздела «## Страница N»)
+    """
+    pages_lines = {num: compact_text(data.get('text', '')).split('\n') for num, data in pages.items()}
+    repeated = repeated_lines(list(pages_lines.values()))
+    seen_repeated = set()
+
+    sections = []
+    for page_num, page_data in pages.items():
+        lines = pages_lines[page_num]
+        edges = _edge_lines(lines)
+        kept = []
+        dropped = []
+        for i, line in enumerate(lines):
+            if i in edges and line:
+                key = _boilerplate_key(line)
+                if key in repeated:
+                    if key in seen_repeated:
+                        dropped.append(key)
+                        continue
+                    seen_repeated.add(key)
+            kept.append(line)
+
+        text = '\n'.join(kept).strip()
+        if not text and dropped:
+            # Страница, состоящая только из повторяющихся строк, не пропадает из запроса
+            text = '\n'.join(lines).strip()
+        blocks = [f"## Страница {page_num}"]
+        if text:
+            blocks.append(text)
+        for number, table in enumerate(page_data.get('tables', []), start=1):
+            rendered = table_markdown(table.get('data', ''))
+            if rendered:
+                blocks.append(f"Таблица {table.get('number', number)}:\n{rendered}")
+
+        flat_text = ' '.join(text.split())
+        for image in page_data.get('images', []):
+            description = compact_text(image.get('description', ''))
+            if description:
+                blocks.append(f"Изображение: {description}")
+            ocr_text = compact_text(image.get('ocr_text', ''))
+            if ocr_text and ' '.join(ocr_text.split()) not in flat_text:
+                blocks.append(f"Текст на изображении: {ocr_text}")
+        sections.append((page_num, '\n'.join(blocks)))
+    return sections
+
+
+def serialize_content(content):
+    """
+    Готовит результат MainModel_MainModule.content() к вставке в запрос к модели.
+    Размер до и после (в оценке токенов) попадает в метрики
+    prompt_document_tokens{form=raw|compact} и prompt_token_reduction_ratio.
+    :param content: Словарь страниц PDF или текст (DOCX, описание изображения)
+    :return: Компактный текст документа
+    """
+    if isinstance(content, dict):
+        serialized = serialize_pages(content)
+        kind = 'pages'
+    else:
+        serialized = compact_text(content)
+        kind = 'text'
+
+    # Прежний запрос содержал str(content) целиком - с ним и сравниваем
+    raw_tokens = estimate_tokens(str(content))
+    compact_tokens = estimate_tokens(serialized)
+    metrics.observe('prompt_document_tokens', raw_tokens, kind=kind, form='raw')
+    metrics.observe('prompt_document_tokens', compact_tokens, kind=kind, form='compact')
+    if raw_tokens:
+        metrics.observe('prompt_token_reduction_ratio', round(1 - compact_tokens / raw_tokens, 4),
+                        buckets=(0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 1.0), kind=kind)
+    return serialized
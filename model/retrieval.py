@@ -0,0 +1,132 @@
+import re
+import math
+from collections import Counter
+import numpy as np
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре (кириллица и латиница)."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def page_text(page_data):
+    """Собирает текст страницы PDF: текст, таблицы, OCR и описания изображений."""
+    parts = [page_data.get('text', '')]
+    parts.extend(table['data'] for table in page_data.get('tables', []))
+    for image in page_data.get('images', []):
+        parts.append(image.get('ocr_text', ''))
+        parts.append(image.get('description', ''))
+    return '\n'.join(part for part in parts if part)
+
+
+def split_chunks(text, chunk_words=200, overlap=40):
+    """
+    Делит текст на фрагменты примерно по chunk_words слов с перекрытием.
+    Границы фрагментов проходят по пробелам, исходное форматирование внутри сохраняется.
+    """
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap)
+    return [
+        ' '.join(words[start:start + chunk_words])
+        for start in range(0, max(1, len(words) - overlap), step)
+    ]
+
+
+class DocumentIndex:
+    """
+    Локальный поисковый индекс по документу (BM25).
+    Строится один раз при загрузке: документ делится на фрагменты со
+    ссылками на страницы, для каждого слова хранится список фрагментов
+    с заранее посчитанными весами BM25 в массивах NumPy. Поиск по вопросу
+    складывает веса его слов, поэтому в запрос к модели уходят только
+    top_k самых релевантных фрагментов, а не весь документ.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        """
+        :param chunks: Список словарей {'page': номер страницы или None, 'text': текст}
+        :param k1: Параметр насыщения частоты слова BM25
+        :param b: Параметр нормализации по длине фрагмента BM25
+        """
+        self.chunks = chunks
+        self._postings = {}
+
+        counts = [Counter(tokenize(chunk['text'])) for chunk in chunks]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        if not len(chunks):
+            return
+        avg_length = float(lengths.mean()) or 1.0
+
+        # Инвертированный индекс: слово -> (номера фрагментов, частоты)
+        raw = {}
+        for chunk_id, chunk_counts in enumerate(counts):
+            for term, tf in chunk_counts.items():
+                ids, tfs = raw.setdefault(term, ([], []))
+                ids.append(chunk_id)
+                tfs.append(tf)
+
+        n = len(chunks)
+        for term, (ids, tfs) in raw.items():
+            ids = np.array(ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = k1 * (1 - b + b * lengths[ids] / avg_length)
+            self._postings[term] = (ids, (idf * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32))
+
+    @classmethod
+    def from_content(cls, content, chunk_words=200, overlap=40):
+        """
+        Строит индекс по результату MainModel_MainModule.content().
+        :param content: Словарь страниц PDF или текст (DOCX, описание изображения)
+        """
+        chunks = []
+        if isinstance(content, dict):
+            for page_num, page_data in content.items():
+                for text in split_chunks(page_text(page_data), chunk_words, overlap):
+                    chunks.append({'page': page_num, 'text': text})
+        else:
+            for text in split_chunks(str(content), chunk_words, overlap):
+                chunks.append({'page': None, 'text': text})
+        return cls(chunks)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, top_k=5):
+        """
+        Ищет фрагменты, наиболее релевантные запросу.
+        :return: Список (оценка, фрагмент) по убыванию оценки
+        """
+        if not self.chunks:
+            return []
+
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights
+
+        top_k = min(top_k, len(self.chunks))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(float(scores[i]), self.chunks[i]) for i in top if scores[i] > 0]
+
+    def build_context(self, query, top_k=5):
+        """
+        Формирует текст с релевантными фрагментами и ссылками на страницы.
+        Если ничего не найдено, возвращаются первые фрагменты документа.
+        """
+        found = [chunk for _, chunk in self.search(query, top_k)]
+        if not found:
+            found = self.chunks[:top_k]
+
+        parts = []
+        for chunk in found:
+            label = f"[Страница {chunk['page']}]" if chunk['page'] is not None else "[Фрагмент]"
+            parts.append(f"{label}\n{chunk['text']}")
+        return '\n\n'.join(parts)
@@ -0,0 +1,45 @@
+from model.prompt import serialize_pages
+
+
+def _page(text):
+    return {'text': text, 'tables': [], 'images': []}
+
+
+def test_short_pages_with_different_numbers_keep_their_content():
+    pages = {
+        n: _page(f"Счёт № {n}\nПоставщик: ООО «Ромашка»\nИтого к оплате: {n * 1000} руб.\nСтр. {n} из 4")
+        for n in range(1, 5)
+    }
+    text = serialize_pages(pages)
+
+    for n in range(1, 5):
+        assert f"Счёт № {n}" in text
+        assert f"Итого к оплате: {n * 1000} руб." in text
+
+
+def test_page_numbers_and_exact_headers_are_kept_once():
+    pages = {
+        n: _page(f"ООО «Ромашка» Годовой отчёт\nТекст страницы {n}\nи продолжение\nСтр. {n} из 5")
+        for n in range(1, 6)
+    }
+    text = serialize_pages(pages)
+
+    assert text.count("ООО «Ромашка» Годовой отчёт") == 1
+    assert text.count("Стр.") == 1
+    for n in range(1, 6):
+        assert f"Текст страницы {n}" in text
+
+
+def test_page_of_repeated_lines_only_is_not_emptied():
+    pages = {n: _page("Шапка\nПодвал") for n in range(1, 4)}
+    sections = serialize_pages(pages).split("## Страница ")[1:]
+
+    assert all("Шапка" in section for section in sections)
+
+
+def test_pdf_and_docx_tables_share_markdown():
+    from model.prompt import rows_markdown, table_markdown
+
+    rows = [['Товар', 'Цена', ''], ['Чай\nзелёный', '100', ''], ['', '', '']]
+    assert table_markdown("|Товар|Цена|None|\n|Чай зелёный|100|None|") == rows_markdown(rows)
+    assert rows_markdown(rows) == "|Товар|Цена|\n|-|-|\n|Чай зелёный|100|"